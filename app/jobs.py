@@ -0,0 +1,215 @@
+# app/jobs.py
+
+"""
+Background ingestion jobs.
+
+/ingest and /ingest_all submit a job and return its id immediately. A
+bounded thread pool (INGEST_JOB_WORKERS) runs the jobs, and /jobs/{id}
+reports per-company stage and filing counts. This keeps API workers free
+to serve chat while long ingests run.
+
+- Dedup: a company/form that is already queued or running with the same
+  options (limit_per_form, full_refresh) is not ingested twice. Its
+  existing job id is returned, and a multi-company request only gets a
+  new job for the companies not already in flight. With different
+  options the company goes into a new job that starts once the in-flight
+  one has finished (listed under "follows"), so two jobs never write the
+  same company's index at once.
+- Cancellation is cooperative. The job stops at the next progress report
+  (between planning, each parsed filing and each company's indexing).
+  Companies already indexed stay indexed and are reported as done.
+
+Jobs live in this process's memory. With several uvicorn workers, poll the
+worker that accepted the job (or run one worker for ingestion).
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from helper_lib.utils import normalize_cik
+
+from .rag_pipeline import ingest_multiple_companies, IngestCancelled
+
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "200"))
+
+ACTIVE = ("queued", "running")
+
+
+class IngestJob:
+    def __init__(self, ciks: list, form: str, limit_per_form: int, full_refresh: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.ciks = ciks
+        self.form = form
+        self.limit_per_form = limit_per_form
+        self.full_refresh = full_refresh
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.companies = {cik: {"stage": "queued"} for cik in ciks}
+        self.results = None
+        self.error = None
+        self.after = []  # jobs that must finish first (same companies, other options)
+        self.cancel_requested = threading.Event()
+        self.done = threading.Event()
+
+    def options(self) -> tuple:
+        return self.limit_per_form, self.full_refresh
+
+    def progress(self, cik: str, stage: str, **counts):
+        # "done" is reported after the company's index and catalog are
+        # written; raising there would mark committed work as cancelled
+        if stage != "done" and self.cancel_requested.is_set():
+            raise IngestCancelled(self.id)
+        entry = self.companies.setdefault(cik, {})
+        entry["stage"] = stage
+        entry.update(counts)
+
+    def to_dict(self) -> dict:
+        stages = [c["stage"] for c in self.companies.values()]
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "form": self.form,
+            "ciks": self.ciks,
+            "companies_done": stages.count("done"),
+            "companies_total": len(self.ciks),
+            "companies": self.companies,
+            "elapsed_s": round(end - (self.started_at or end), 1),
+            "results": self.results,
+            "error": self.error,
+            "waits_for": [j.id for j in self.after],
+        }
+
+
+_jobs = {}      # job id -> IngestJob (recent history included)
+_inflight = {}  # (cik, form) -> job id while queued/running
+_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=INGEST_JOB_WORKERS, thread_name_prefix="ingest")
+
+
+def _run(job: IngestJob):
+    # Jobs are started in submit order, so the ones waited on here are
+    # already running or finished and never wait on this one
+    for other in job.after:
+        while not other.done.wait(0.5) and not job.cancel_requested.is_set():
+            pass
+    if job.cancel_requested.is_set():
+        return _finish(job, "cancelled")
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        job.results = ingest_multiple_companies(
+            job.ciks,
+            form=job.form,
+            limit_per_form=job.limit_per_form,
+            full_refresh=job.full_refresh,
+            progress=job.progress,
+        )
+        _finish(job, "succeeded")
+    except IngestCancelled:
+        _finish(job, "cancelled")
+    except Exception as e:
+        print(f"❌ Ingest job {job.id} failed: {e}")
+        job.error = str(e)
+        _finish(job, "failed")
+
+
+def _finish(job: IngestJob, status: str):
+    job.status = status
+    job.finished_at = time.time()
+    with _lock:
+        for cik in job.ciks:
+            if _inflight.get((cik, job.form)) == job.id:
+                del _inflight[(cik, job.form)]
+        # Keep a bounded history of finished jobs
+        finished = [j for j in _jobs.values() if j.status not in ACTIVE]
+        for old in sorted(finished, key=lambda j: j.created_at)[:-JOB_HISTORY or None]:
+            del _jobs[old.id]
+    job.done.set()
+
+
+def submit_ingest(ciks: list, form: str = "10-K", limit_per_form: int = 3, full_refresh: bool = False) -> dict:
+    """
+    Queues an ingest for the companies not already being ingested with the
+    same options. Returns {"job_id", "status", "deduplicated": {cik:
+    existing job id}, "follows": {cik: job id this one waits for}}.
+    """
+    ciks = list(dict.fromkeys(normalize_cik(c) for c in ciks))
+    options = (limit_per_form, full_refresh)
+    with _lock:
+        inflight = {c: _jobs[_inflight[(c, form)]] for c in ciks if (c, form) in _inflight}
+        existing = {c: j.id for c, j in inflight.items() if j.options() == options}
+        follows = {c: j.id for c, j in inflight.items() if j.options() != options}
+        todo = [c for c in ciks if c not in existing]
+        if not todo:
+            first = next(iter(existing.values()))
+            return {"job_id": first, "status": _jobs[first].status, "deduplicated": existing, "follows": {}}
+
+        job = IngestJob(todo, form, limit_per_form, full_refresh)
+        job.after = [_jobs[j] for j in dict.fromkeys(follows.values())]
+        _jobs[job.id] = job
+        for c in todo:
+            _inflight[(c, form)] = job.id
+
+    _pool.submit(_run, job)
+    print(f"📥 Queued ingest job {job.id}: {len(todo)} companies ({form})")
+    return {"job_id": job.id, "status": job.status, "deduplicated": existing, "follows": follows}
+
+
+def get_job(job_id: str):
+    job = _jobs.get(job_id)
+    return job.to_dict() if job else None
+
+
+def list_jobs() -> list:
+    with _lock:
+        jobs = sorted(_jobs.values(), key=lambda j: j.created_at, reverse=True)
+    return [
+        {"job_id": j.id, "status": j.status, "form": j.form, "ciks": j.ciks}
+        for j in jobs
+    ]
+
+
+def cancel_job(job_id: str):
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    if job.status in ACTIVE:
+        job.cancel_requested.set()
+    return job.to_dict()
+
+
+def wait_for_job(job_id: str, timeout: float = None):
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    job.done.wait(timeout)
+    return job.to_dict()
+
+
+def wait_for_ingest(submitted: dict, ciks: list, form: str) -> dict:
+    """
+    Blocks until every job covering `ciks` has finished: the one
+    submit_ingest queued and any it deduplicated against. Returns
+    {"status", "job_ids", "results"} with one result per requested CIK, in
+    request order (None where its job failed or was cancelled first).
+    """
+    ciks = list(dict.fromkeys(normalize_cik(c) for c in ciks))
+    owner = {c: submitted["deduplicated"].get(c, submitted["job_id"]) for c in ciks}
+    jobs = {job_id: wait_for_job(job_id) for job_id in dict.fromkeys(owner.values())}
+
+    results = []
+    for cik in ciks:
+        job = jobs[owner[cik]]
+        matches = [r for r in (job or {}).get("results") or [] if r["cik"] == cik and job["form"] == form]
+        results.append(matches[0] if matches else None)
+
+    statuses = [job["status"] for job in jobs.values() if job]
+    status = next((s for s in ("failed", "cancelled") if s in statuses), "succeeded")
+    return {"status": status, "job_ids": list(jobs), "results": results}
@@ -1,21 +1,27 @@
 # app/main.py
 
 import json
-from typing import List
-from fastapi import FastAPI
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from .rag_pipeline import (
-    ingest_company,
-    ingest_multiple_companies,
     chat_stream,
     chat_stream_multi
 )
+from .jobs import submit_ingest, get_job, list_jobs, cancel_job, wait_for_ingest
 
+from helper_lib.retriever import search_many, index_cache_stats
+from helper_lib.sec_cache import cache_stats as sec_cache_stats
 from helper_lib.xbrl import (
     get_key_financial_metrics,
-    get_company_kpis_for_compare
+    get_company_kpis_for_compare,
+    compare_companies,
+    get_derived_metrics,
+    known_concepts,
+    panel_to_json,
+    xbrl_cache_stats
 )
 
 app = FastAPI(
@@ -31,27 +37,61 @@ class Message(BaseModel):
     role: str
     content: str
 
+class SearchFilters(BaseModel):
+    date_from: Optional[str] = None   # filing_date >= (YYYY-MM-DD)
+    date_to: Optional[str] = None     # filing_date <= (YYYY-MM-DD)
+    latest_only: bool = False         # only the most recent filing
+    accessions: Optional[List[str]] = None
+    forms: Optional[List[str]] = None
+    sections: Optional[List[str]] = None
+
+    def as_dict(self) -> dict:
+        return self.model_dump(exclude_none=True, exclude_defaults=True)
+
+def _filters(f: Optional[SearchFilters]):
+    return f.as_dict() if f is not None else None
+
 class IngestRequest(BaseModel):
     cik: str
     form: str = "10-K"
     limit_per_form: int = 3
+    full_refresh: bool = False
+    wait: bool = False  # block until the job finishes (old synchronous behaviour)
 
 class MultiIngestRequest(BaseModel):
     ciks: List[str]
     form: str = "10-K"
     limit_per_form: int = 3
+    full_refresh: bool = False
+    wait: bool = False
 
 class ChatRequest(BaseModel):
     cik: str
     messages: List[Message]
     form: str = "10-K"
     k: int = 5
+    retrieval_mode: Optional[str] = None  # "vector" | "hybrid"
+    filters: Optional[SearchFilters] = None
 
 class MultiChatRequest(BaseModel):
     ciks: List[str]
     messages: List[Message]
     form: str = "10-K"
     k: int = 5
+    retrieval_mode: Optional[str] = None  # "vector" | "hybrid"
+    filters: Optional[SearchFilters] = None
+
+class CompareRequest(BaseModel):
+    companies: List[str]              # CIKs or tickers
+    concepts: List[str] = ["Revenues", "NetIncome"]  # base or derived (e.g. "NetMargin")
+    years: Optional[List[int]] = None
+
+class SearchBatchRequest(BaseModel):
+    cik: str
+    queries: List[str]
+    form: str = "10-K"
+    k: int = 5
+    filters: Optional[SearchFilters] = None
 
 
 # -----------------------------
@@ -64,22 +104,43 @@ def root():
 # SINGLE INGEST
 @app.post("/ingest")
 def ingest(req: IngestRequest):
-    ingest_company(
-        cik=req.cik,
-        form=req.form,
-        limit_per_form=req.limit_per_form
-    )
-    return {"status": "ok", "message": f"Ingested {req.form} for CIK={req.cik}"}
+    job = submit_ingest([req.cik], form=req.form, limit_per_form=req.limit_per_form, full_refresh=req.full_refresh)
+    if req.wait:
+        # A deduplicated request waits on the job already ingesting this
+        # company; take this company's result, not that job's first one
+        done = wait_for_ingest(job, [req.cik], req.form)
+        return {"status": done["status"], "message": f"Ingested {req.form} for CIK={req.cik}",
+                "job_id": job["job_id"], "result": done["results"][0]}
+    return {"status": "queued", "message": f"Ingest of {req.form} for CIK={req.cik} queued", **job}
 
 # MULTI-INGEST
 @app.post("/ingest_all")
 def ingest_all(req: MultiIngestRequest):
-    ingest_multiple_companies(
-        cik_list=req.ciks,
-        form=req.form,
-        limit_per_form=req.limit_per_form
-    )
-    return {"status": "ok", "message": f"Ingested {len(req.ciks)} companies"}
+    job = submit_ingest(req.ciks, form=req.form, limit_per_form=req.limit_per_form, full_refresh=req.full_refresh)
+    if req.wait:
+        done = wait_for_ingest(job, req.ciks, req.form)
+        return {"status": done["status"], "message": f"Ingested {len(req.ciks)} companies",
+                "job_id": job["job_id"], "job_ids": done["job_ids"], "results": done["results"]}
+    return {"status": "queued", "message": f"Ingest of {len(req.ciks)} companies queued", **job}
+
+# INGEST JOBS
+@app.get("/jobs")
+def jobs():
+    return {"jobs": list_jobs()}
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+def job_cancel(job_id: str):
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
 
 # SINGLE COMPANY CHAT
 @app.post("/chat")
@@ -89,7 +150,9 @@ async def chat_endpoint(req: ChatRequest):
             cik=req.cik,
             messages=req.messages,
             form=req.form,
-            k=req.k
+            k=req.k,
+            retrieval_mode=req.retrieval_mode,
+            filters=_filters(req.filters)
         ),
         media_type="text/event-stream"
     )
@@ -102,16 +165,32 @@ async def chat_multi_endpoint(req: MultiChatRequest):
             ciks=req.ciks,
             messages=req.messages,
             form=req.form,
-            k=req.k
+            k=req.k,
+            retrieval_mode=req.retrieval_mode,
+            filters=_filters(req.filters)
         ),
         media_type="text/event-stream"
     )
 
+# BATCH SEARCH (offline screening)
+@app.post("/search_batch")
+def search_batch(req: SearchBatchRequest):
+    results = search_many(req.queries, cik=req.cik, form=req.form, k=req.k, filters=_filters(req.filters))
+    return {
+        "cik": req.cik,
+        "form": req.form,
+        "results": [
+            {"query": q, "hits": hits.to_dict(orient="records")}
+            for q, hits in zip(req.queries, results)
+        ]
+    }
+
 # KPI (Single)
 @app.get("/kpi/{cik}")
 def get_kpis(cik: str):
     data = get_key_financial_metrics(cik)
-    return {"cik": cik, "kpis": data}
+    derived = panel_to_json(get_derived_metrics([cik])) if data["status"] == "success" else {}
+    return {"cik": cik, "kpis": data, "derived": derived}
 
 # Comparison KPIs
 @app.get("/compare_kpis")
@@ -119,3 +198,22 @@ def compare_kpis(cik1: str, cik2: str):
     data1 = get_company_kpis_for_compare(cik1)
     data2 = get_company_kpis_for_compare(cik2)
     return {"company1": data1, "company2": data2}
+
+# Comparison KPIs (N companies, year-aligned)
+@app.post("/compare_kpis_batch")
+def compare_kpis_batch(req: CompareRequest):
+    if not req.companies:
+        raise HTTPException(status_code=400, detail="companies must not be empty")
+    unknown = [c for c in req.concepts if c not in known_concepts()]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown concepts {unknown}; expected any of {list(known_concepts())}")
+    return compare_companies(req.companies, concepts=tuple(req.concepts), years=req.years)
+
+# Cache health (tune XBRL_MAX_AGE / SUBMISSIONS_MAX_AGE / INDEX_CACHE_MAX_MB)
+@app.get("/cache_stats")
+def cache_stats():
+    return {
+        "xbrl": xbrl_cache_stats(),
+        "sec": sec_cache_stats(),
+        "index": index_cache_stats(),
+    }
@@ -1,20 +1,47 @@
 # app/rag_pipeline.py
 
 import json
-from typing import List, Generator
+import threading
+from typing import Callable, List, Generator
 from openai import OpenAI
 import pandas as pd
 
-from helper_lib.edgar_parser import build_chunks_for_filings
+from helper_lib import catalog
+from helper_lib.edgar_parser import (
+    select_filings,
+    download_filings,
+    iter_parsed_filings,
+    parse_job_args
+)
 from helper_lib.retriever import (
     build_index_for_chunks,
+    update_index_for_chunks,
+    update_global_index_many,
+    has_index,
+    load_meta,
     search,
     multi_search
 )
 from helper_lib.utils import save_chunks_df, normalize_cik
-from helper_lib.xbrl import get_key_financial_metrics
+from helper_lib.xbrl import (
+    get_key_financial_metrics,
+    get_kpi_panel,
+    get_derived_metrics,
+    derived_concepts,
+    panel_to_json,
+    CONCEPTS
+)
 
-client = OpenAI()
+_client = None
+_client_lock = threading.Lock()
+
+def _get_client() -> OpenAI:
+    # Created on first chat so ingest with the hash backend needs no API key.
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI()
+    return _client
 
 # SYSTEM PROMPT stays unchanged
 SYSTEM_PROMPT_TEMPLATE = """
@@ -35,25 +62,157 @@ You are an expert financial analyst assistant (EDGAR Copilot).
 {xbrl_json}
 """
 
+DERIVED_PROMPT = """
+
+### DERIVED METRICS (JSON, precomputed from the XBRL financials):
+Margins, growth, CAGR and leverage per fiscal year. Ratios are fractions (0.25 = 25%).
+Quote these instead of recomputing them; null means not computable.
+{derived_json}
+"""
+
 # -----------------------------
 # Single-company ingest
 # -----------------------------
-def ingest_company(cik: str, form: str = "10-K", limit_per_form: int = 3):
+def _plan_ingest(cik: str, form: str, limit_per_form: int, full_refresh: bool) -> dict:
+    """Works out which filings need downloading/embedding for a company."""
     cik = normalize_cik(cik)
-    chunks_df = build_chunks_for_filings(
-        cik=cik,
-        form_types=(form,),
-        limit_per_form=limit_per_form
-    )
-    save_chunks_df(chunks_df, cik, form)
-    build_index_for_chunks(chunks_df, cik, form)
+    filings = select_filings(cik, form_types=(form,), limit_per_form=limit_per_form)
+    wanted = filings["accessionNumber"].tolist()
+    known = catalog.get_ingested_accessions(cik, form)
+
+    if full_refresh or not known or not has_index(cik, form):
+        return {"cik": cik, "form": form, "rebuild": True, "filings": filings,
+                "new": wanted, "dropped": []}
+
+    new_accs = [a for a in wanted if a not in known]
+    dropped = [a for a in known if a not in wanted]
+    return {"cik": cik, "form": form, "rebuild": False,
+            "filings": filings[filings["accessionNumber"].isin(new_accs)],
+            "new": new_accs, "dropped": dropped}
+
+def _apply_ingest(plan: dict, chunks_df: pd.DataFrame, global_updates: list = None) -> dict:
+    """Embeds a company's new chunks and records the result in the catalog."""
+    cik, form = plan["cik"], plan["form"]
+    if plan["rebuild"]:
+        info = build_index_for_chunks(chunks_df, cik, form, global_updates=global_updates)
+    else:
+        info = update_index_for_chunks(chunks_df, cik, form, drop_accessions=plan["dropped"],
+                                       global_updates=global_updates)
+
+    # Filings that parsed to nothing are still recorded, so incremental runs
+    # don't download and parse them again
+    parsed = set(chunks_df["accession"]) if not chunks_df.empty else set()
+    empty = [
+        (row["accessionNumber"], row["filingDate"], row["primaryDocument"])
+        for _, row in plan["filings"].iterrows()
+        if row["accessionNumber"] not in parsed
+    ]
+    if not plan["rebuild"]:
+        empty += [f for f in catalog.get_empty_filings(cik, form) if f[0] not in plan["dropped"]]
+
+    meta_df = load_meta(cik, form)
+    save_chunks_df(meta_df, cik, form)
+    catalog.record_index(cik, form, meta_df, info["version"], empty_filings=empty)
+    return {"cik": cik, "new": plan["new"], "dropped": plan["dropped"], "up_to_date": False}
+
+def _is_up_to_date(plan: dict) -> bool:
+    return not plan["rebuild"] and not plan["new"] and not plan["dropped"]
+
+def _up_to_date(plan: dict) -> dict:
+    print(f"✅ CIK={plan['cik']} {plan['form']} already up to date")
+    return {"cik": plan["cik"], "new": [], "dropped": [], "up_to_date": True}
+
+def ingest_company(cik: str, form: str = "10-K", limit_per_form: int = 3, full_refresh: bool = False,
+                   progress: Callable = None) -> dict:
+    """
+    Brings a company's index in line with its `limit_per_form` latest
+    filings. Only accessions missing from the catalog are downloaded and
+    embedded; ones that fell out of the window are dropped.
+    """
+    return ingest_multiple_companies([cik], form=form, limit_per_form=limit_per_form,
+                                     full_refresh=full_refresh, progress=progress)[0]
 
 # -----------------------------
 # Multi-company ingest
 # -----------------------------
-def ingest_multiple_companies(cik_list: List[str], form="10-K", limit_per_form=3):
+class IngestCancelled(Exception):
+    """Raised by a progress callback to stop an ingest between steps."""
+
+def _report(progress, cik, stage, **counts):
+    # The callback may raise IngestCancelled at any stage but "done", which
+    # is reported after the company is committed
+    if progress is not None:
+        progress(cik, stage, **counts)
+
+def ingest_multiple_companies(cik_list: List[str], form="10-K", limit_per_form=3, full_refresh=False,
+                              workers: int = None, progress: Callable = None) -> list:
+    """
+    Ingests a watchlist. Filings of all companies are parsed and chunked in
+    one process pool (PARSE_WORKERS); as soon as every filing of a company is
+    done, that company is embedded and indexed while the pool keeps parsing
+    the others.
+
+    `progress(cik, stage, **counts)` is called as each company moves through
+    planning → downloading → parsing → indexing → done.
+
+    With GLOBAL_INDEX=1 the global index is updated once for the whole
+    watchlist at the end (also when the ingest is cancelled part-way), not
+    rewritten after every company.
+    """
+    plans, results, global_updates = {}, {}, []
     for cik in cik_list:
-        ingest_company(cik, form=form, limit_per_form=limit_per_form)
+        _report(progress, normalize_cik(cik), "planning")
+        plan = _plan_ingest(cik, form, limit_per_form, full_refresh)
+        if _is_up_to_date(plan):
+            results[plan["cik"]] = _up_to_date(plan)
+            _report(progress, plan["cik"], "done")
+        else:
+            plans[plan["cik"]] = plan
+
+    try:
+        downloads, keys, pending = [], [], {}
+        for cik, plan in plans.items():
+            rows = [row for _, row in plan["filings"].iterrows()]
+            pending[cik] = {"left": len(rows), "parts": {}}
+            _report(progress, cik, "downloading", filings_total=len(rows))
+            for pos, row in enumerate(rows):
+                downloads.append((cik, row))
+                keys.append((cik, pos))
+
+        paths = download_filings(downloads)
+        jobs = [
+            (key, parse_job_args(cik, row, path))
+            for key, (cik, row), path in zip(keys, downloads, paths)
+        ]
+
+        def finish(cik, chunks_df):
+            _report(progress, cik, "indexing", chunks=len(chunks_df))
+            results[cik] = _apply_ingest(plans[cik], chunks_df, global_updates)
+            # Warm the XBRL cache so the first chat turn doesn't wait on SEC
+            get_key_financial_metrics(cik, background_refresh=True)
+            _report(progress, cik, "done")
+
+        for cik, state in list(pending.items()):
+            if state["left"]:
+                _report(progress, cik, "parsing", filings_done=0)
+            else:
+                finish(cik, pd.DataFrame())
+                del pending[cik]
+
+        for (cik, pos), chunks in iter_parsed_filings(jobs, workers):
+            state = pending[cik]
+            state["parts"][pos] = chunks
+            state["left"] -= 1
+            _report(progress, cik, "parsing", filings_done=len(state["parts"]))
+            if state["left"] == 0:
+                rows = [c for i in sorted(state["parts"]) for c in state["parts"][i]]
+                finish(cik, pd.DataFrame(rows))
+                del pending[cik]
+    finally:
+        if global_updates:
+            update_global_index_many(global_updates, form)
+
+    return [results[normalize_cik(cik)] for cik in cik_list]
 
 # -----------------------------
 # Format context
@@ -65,6 +224,7 @@ def format_rag_context(hits) -> str:
             acc_clean = str(row['accession']).replace("-", "")
             primary_doc = row.get('primary_doc', '')
             filing_date = row.get('filing_date', 'Unknown')
+            section = row.get('section')
             
             if primary_doc and not pd.isna(primary_doc):
                 url = (
@@ -75,6 +235,9 @@ def format_rag_context(hits) -> str:
             else:
                 meta = f"[Source: {row['accession']}] | Date: {filing_date}"
 
+            if section and not pd.isna(section):
+                meta += f" | Section: {section}"
+
         except:
             meta = f"[Source: {row['accession']}]"
 
@@ -85,24 +248,29 @@ def format_rag_context(hits) -> str:
 # -----------------------------
 # SINGLE-COMPANY CHAT
 # -----------------------------
-def chat_stream(cik: str, messages: List[object], form="10-K", k=5) -> Generator:
+def chat_stream(cik: str, messages: List[object], form="10-K", k=5, retrieval_mode=None, filters=None) -> Generator:
     cik = normalize_cik(cik)
     last_user_msg = messages[-1].content
 
-    xbrl_data = get_key_financial_metrics(cik)
+    xbrl_data = get_key_financial_metrics(cik, background_refresh=True)
     xbrl_str = json.dumps(xbrl_data, indent=2)
+    derived = get_derived_metrics([cik]) if xbrl_data["status"] == "success" else {}
 
-    hits = search(last_user_msg, cik=cik, form=form, k=k)
+    hits = search(last_user_msg, cik=cik, form=form, k=k, mode=retrieval_mode, filters=filters)
     context_str = format_rag_context(hits)
 
     system_content = SYSTEM_PROMPT_TEMPLATE.format(xbrl_json=xbrl_str)
+    if derived:
+        system_content += DERIVED_PROMPT.format(
+            derived_json=json.dumps(panel_to_json({m: df.round(4) for m, df in derived.items()}), indent=2)
+        )
     system_content += f"\n\n### TEXT CONTEXT:\n{context_str}"
 
     final_messages = [{"role": "system", "content": system_content}]
     for m in messages:
         final_messages.append({"role": m.role, "content": m.content})
 
-    stream = client.chat.completions.create(
+    stream = _get_client().chat.completions.create(
         model="gpt-4o",
         messages=final_messages,
         temperature=0.1,
@@ -116,29 +284,31 @@ def chat_stream(cik: str, messages: List[object], form="10-K", k=5) -> Generator
 # -----------------------------
 # MULTI-COMPANY CHAT
 # -----------------------------
-def chat_stream_multi(ciks: List[str], messages: List[object], form="10-K", k=5) -> Generator:
+def chat_stream_multi(ciks: List[str], messages: List[object], form="10-K", k=5, retrieval_mode=None, filters=None) -> Generator:
     last_user_msg = messages[-1].content
 
-    # ---- Merge XBRL JSON ----
-    xbrl_map = {}
+    # ---- XBRL panel: one fy × company table per concept ----
     for cik in ciks:
-        data = get_key_financial_metrics(cik)
-        xbrl_map[cik] = data
-
-    xbrl_str = json.dumps(xbrl_map, indent=2)
+        get_key_financial_metrics(cik, background_refresh=True)  # keeps the fact store warm
+    metrics = derived_concepts()
+    panels = get_kpi_panel(ciks, concepts=tuple(CONCEPTS) + metrics)
+    xbrl_str = json.dumps(panel_to_json({c: panels[c] for c in CONCEPTS}), indent=2)
+    derived_str = json.dumps(panel_to_json({m: panels[m].round(4) for m in metrics}), indent=2)
 
     # ---- MULTI SEARCH ----
-    hits = multi_search(last_user_msg, cik_list=ciks, form=form, k=k)
+    hits = multi_search(last_user_msg, cik_list=ciks, form=form, k=k, mode=retrieval_mode, filters=filters)
     context_str = format_rag_context(hits)
 
     system_content = SYSTEM_PROMPT_TEMPLATE.format(xbrl_json=xbrl_str)
+    if metrics:
+        system_content += DERIVED_PROMPT.format(derived_json=derived_str)
     system_content += "\n\n### MULTI-COMPANY TEXT CONTEXT:\n" + context_str
 
     final_messages = [{"role": "system", "content": system_content}]
     for m in messages:
         final_messages.append({"role": m.role, "content": m.content})
 
-    stream = client.chat.completions.create(
+    stream = _get_client().chat.completions.create(
         model="gpt-4o",
         messages=final_messages,
         temperature=0.1,
@@ -5,6 +5,7 @@ import streamlit as st
 import requests
 import pandas as pd
 import re
+import time
 
 API_BASE = "http://localhost:8000"
 
@@ -18,6 +19,18 @@ def render_math(msg: str):
 
     return re.sub(pattern, repl, msg)
 
+def follow_job(job_id: str) -> dict:
+    """Polls an ingest job, showing per-company progress, until it finishes."""
+    bar = st.progress(0.0, text="Queued...")
+    while True:
+        job = requests.get(f"{API_BASE}/jobs/{job_id}", timeout=10).json()
+        total = max(job["companies_total"], 1)
+        stages = ", ".join(f"{cik}: {c['stage']}" for cik, c in job["companies"].items())
+        bar.progress(job["companies_done"] / total, text=f"{job['status']} — {stages}")
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(2)
+
 # ========================================================================
 # PAGE CONFIG
 # ========================================================================
@@ -40,19 +53,22 @@ with st.sidebar:
         cik_input = st.text_input("Enter Company CIK or Ticker", value="COST")
 
         if st.button("Ingest / Refresh Data"):
-            with st.spinner("Ingesting..."):
-                try:
-                    r = requests.post(
-                        f"{API_BASE}/ingest",
-                        json={"cik": cik_input, "form": "10-K", "limit_per_form": 1},
-                        timeout=60
-                    )
-                    if r.status_code == 200:
+            try:
+                r = requests.post(
+                    f"{API_BASE}/ingest",
+                    json={"cik": cik_input, "form": "10-K", "limit_per_form": 1},
+                    timeout=30
+                )
+                if r.status_code == 200:
+                    job = follow_job(r.json()["job_id"])
+                    if job["status"] == "succeeded":
                         st.success("Ingestion Complete!")
                     else:
-                        st.error(r.text)
-                except Exception as e:
-                    st.error(f"Error: {e}")
+                        st.error(f"Ingestion {job['status']}: {job.get('error') or ''}")
+                else:
+                    st.error(r.text)
+            except Exception as e:
+                st.error(f"Error: {e}")
 
     # ---------------- MULTI COMPANY MODE ----------------
     else:
@@ -85,17 +101,20 @@ with st.sidebar:
             if not clean_list:
                 st.error("No valid companies entered.")
             else:
-                with st.spinner("Ingesting all companies..."):
-                    try:
-                        requests.post(
-                            f"{API_BASE}/ingest_all",
-                            json={"ciks": clean_list, "form": "10-K", "limit_per_form": 1},
-                            timeout=120
-                        )
+                try:
+                    r = requests.post(
+                        f"{API_BASE}/ingest_all",
+                        json={"ciks": clean_list, "form": "10-K", "limit_per_form": 1},
+                        timeout=30
+                    )
+                    job = follow_job(r.json()["job_id"])
+                    if job["status"] == "succeeded":
                         st.success("All companies ingested!")
                         st.session_state.all_ingested = True
-                    except Exception as e:
-                        st.error(f"Error: {e}")
+                    else:
+                        st.error(f"Ingestion {job['status']}: {job.get('error') or ''}")
+                except Exception as e:
+                    st.error(f"Error: {e}")
 
 
 # ========================================================================
@@ -330,33 +349,29 @@ else:
         if st.button("Run Comparison"):
             with st.spinner("Fetching comparison..."):
 
-                all_data = {}
-                all_years = set()
-
-                for t in tickers:
-                    r = requests.get(f"{API_BASE}/compare_kpis", params={"cik1": t, "cik2": t})
-                    comp = r.json()["company1"]
-                    all_data[t] = comp
-                    all_years |= set(comp["years"])
-
-                years = sorted(all_years)
-
-                def align(yrs, vals, master):
-                    m = dict(zip(yrs, vals))
-                    return [m.get(y, None) for y in master]
+                r = requests.post(
+                    f"{API_BASE}/compare_kpis_batch",
+                    json={"companies": tickers, "concepts": ["Revenues", "NetIncome"]}
+                )
+                if r.status_code != 200:
+                    st.error(f"Comparison failed: {r.text}")
+                    st.stop()
+                comp = r.json()
+                years = comp["years"]
+                series = comp["series"]
 
                 # Revenue Chart
                 st.subheader("📊 Revenue Comparison")
                 df_rev = {"Year": years}
                 for t in tickers:
-                    df_rev[t.upper()] = align(all_data[t]["years"], all_data[t]["revenue"], years)
+                    df_rev[t.upper()] = series["Revenues"].get(t.strip(), [None] * len(years))
                 st.line_chart(pd.DataFrame(df_rev), x="Year")
 
                 # Net Income Chart
                 st.subheader("📊 Net Income Comparison")
                 df_ni = {"Year": years}
                 for t in tickers:
-                    df_ni[t.upper()] = align(all_data[t]["years"], all_data[t]["net_income"], years)
+                    df_ni[t.upper()] = series["NetIncome"].get(t.strip(), [None] * len(years))
                 st.line_chart(pd.DataFrame(df_ni), x="Year")
 
                 # --- NEW: CSV EXPORT (Multi-Company) ---
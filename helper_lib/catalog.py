@@ -0,0 +1,115 @@
+# helper_lib/catalog.py
+
+"""
+SQLite catalog of what has been ingested, one row per filing:
+(cik, form, accession) → filing date, primary doc, the chunk row range
+it occupies in {cik}_{form}_meta.parquet, and the index version that
+row range belongs to. Ingestion diffs against it to embed only new
+accessions. A filing that produced no chunks is recorded with an empty
+range (chunk_start == chunk_end, n_chunks 0) so it is not downloaded and
+parsed again on every run.
+"""
+
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from .utils import DATA_DIR, normalize_cik
+
+CATALOG_PATH = DATA_DIR / "catalog.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS filings (
+    cik TEXT NOT NULL,
+    form TEXT NOT NULL,
+    accession TEXT NOT NULL,
+    filing_date TEXT,
+    primary_doc TEXT,
+    chunk_start INTEGER NOT NULL,
+    chunk_end INTEGER NOT NULL,
+    index_version INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL,
+    PRIMARY KEY (cik, form, accession)
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(CATALOG_PATH, timeout=30)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def get_ingested_accessions(cik: str, form: str) -> list:
+    cik = normalize_cik(cik)
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT accession FROM filings WHERE cik = ? AND form = ? ORDER BY chunk_start",
+            (cik, form),
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def get_index_version(cik: str, form: str) -> int:
+    cik = normalize_cik(cik)
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT MAX(index_version) FROM filings WHERE cik = ? AND form = ?",
+            (cik, form),
+        ).fetchone()
+    return int(row[0] or 0)
+
+
+def get_empty_filings(cik: str, form: str) -> list:
+    """(accession, filing_date, primary_doc) of recorded filings with no chunks."""
+    cik = normalize_cik(cik)
+    with closing(_connect()) as conn:
+        return conn.execute(
+            "SELECT accession, filing_date, primary_doc FROM filings "
+            "WHERE cik = ? AND form = ? AND chunk_end = chunk_start",
+            (cik, form),
+        ).fetchall()
+
+
+def record_index(cik: str, form: str, meta_df: pd.DataFrame, version: int, empty_filings=()):
+    """
+    Replaces the catalog rows for (cik, form) with the filings in meta_df,
+    plus `empty_filings` ((accession, filing_date, primary_doc) of filings
+    that produced no chunks).
+    """
+    cik = normalize_cik(cik)
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    rows = []
+    df = meta_df.reset_index(drop=True)
+    if not df.empty:
+        for acc, g in df.groupby("accession", sort=False):
+            rows.append((
+                cik, form, acc,
+                str(g["filing_date"].iloc[0]),
+                str(g["primary_doc"].iloc[0]),
+                int(g.index.min()), int(g.index.max()) + 1,
+                int(version), now,
+            ))
+    indexed = {r[2] for r in rows}
+    for acc, filing_date, primary_doc in dict.fromkeys(tuple(map(str, f)) for f in empty_filings):
+        if acc not in indexed:
+            rows.append((cik, form, acc, filing_date, primary_doc, len(df), len(df), int(version), now))
+            indexed.add(acc)
+
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM filings WHERE cik = ? AND form = ?", (cik, form))
+        conn.executemany("INSERT INTO filings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def list_catalog(cik: str = None) -> pd.DataFrame:
+    cols = "*, chunk_end - chunk_start AS n_chunks"
+    with closing(_connect()) as conn:
+        if cik is None:
+            return pd.read_sql_query(f"SELECT {cols} FROM filings ORDER BY cik, form, chunk_start", conn)
+        return pd.read_sql_query(
+            f"SELECT {cols} FROM filings WHERE cik = ? ORDER BY form, chunk_start",
+            conn, params=(normalize_cik(cik),),
+        )
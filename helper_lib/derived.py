@@ -0,0 +1,161 @@
+# helper_lib/derived.py
+
+"""
+Derived financial metrics (margins, growth, CAGR, leverage) computed from
+the base XBRL concepts.
+
+Everything works on fy × cik panels, the same shape fact_store.panel
+returns. Each metric is one vectorized expression over the whole matrix,
+so 1 or 500 companies cost the same number of pandas operations. Panels
+are reindexed to a continuous fiscal-year range first, so shift(n) always
+means "n fiscal years earlier" and a gap in a series gives NaN instead of
+a growth rate across two years.
+
+Derived values are stored in the fact store next to the base facts, as
+their own concepts (data/facts/NetMargin.parquet, ...). xbrl.facts_frame
+appends them whenever a company's facts are written, so they are cached
+and invalidated together with the base facts. `backfill_derived`
+recomputes them for companies stored before a metric existed; it scans
+and rewrites the whole store, so it runs as a one-off migration
+(`python -m helper_lib.derived`), never from a read path.
+
+Ratios are fractions (0.253 = 25.3%). A metric is NaN where its
+denominator is missing, zero or (for growth and CAGR) not positive.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .fact_store import FACT_COLUMNS, list_concepts, query_facts, stored_companies, write_company_facts, flush
+
+# name -> (formula, base concepts it needs)
+DERIVED_METRICS = {
+    "NetMargin": ("NetIncome / Revenues", ("NetIncome", "Revenues")),
+    "OperatingMargin": ("OperatingIncome / Revenues", ("OperatingIncome", "Revenues")),
+    "ReturnOnAssets": ("NetIncome / Assets", ("NetIncome", "Assets")),
+    "DebtRatio": ("Liabilities / Assets", ("Liabilities", "Assets")),
+    "DebtToEquity": ("Liabilities / (Assets - Liabilities)", ("Liabilities", "Assets")),
+    "RevenueYoY": ("Revenues / Revenues[fy-1] - 1", ("Revenues",)),
+    "NetIncomeYoY": ("(NetIncome - NetIncome[fy-1]) / |NetIncome[fy-1]|", ("NetIncome",)),
+    "RevenueCAGR3Y": ("(Revenues / Revenues[fy-3]) ^ (1/3) - 1", ("Revenues",)),
+    "RevenueCAGR5Y": ("(Revenues / Revenues[fy-5]) ^ (1/5) - 1", ("Revenues",)),
+}
+
+
+def _ratio(num: pd.DataFrame, den: pd.DataFrame) -> pd.DataFrame:
+    return num / den.where(den != 0)
+
+
+def _cagr(df: pd.DataFrame, years: int) -> pd.DataFrame:
+    prev = df.shift(years)
+    ok = (df > 0) & (prev > 0)
+    return (df.where(ok) / prev.where(ok)) ** (1.0 / years) - 1
+
+
+def derived_panels(panels: dict, metrics=None) -> dict:
+    """
+    {metric: fy × cik DataFrame} from base panels ({concept: fy × cik}).
+    Metrics whose inputs are not in `panels` are skipped.
+    """
+    metrics = list(metrics or DERIVED_METRICS)
+    base = {k: v for k, v in panels.items() if v is not None and not v.empty}
+    if not base:
+        return {}
+
+    # One continuous fiscal-year index and one column set for every input
+    cols = list(dict.fromkeys(c for df in base.values() for c in df.columns))
+    fys = [int(y) for df in base.values() for y in df.index.dropna()]
+    idx = pd.Index(range(min(fys), max(fys) + 1), name="fy") if fys else pd.Index([], name="fy")
+    p = {k: v.reindex(index=idx, columns=cols).astype("float64") for k, v in base.items()}
+
+    def compute(name):
+        if name == "NetMargin":
+            return _ratio(p["NetIncome"], p["Revenues"])
+        if name == "OperatingMargin":
+            return _ratio(p["OperatingIncome"], p["Revenues"])
+        if name == "ReturnOnAssets":
+            return _ratio(p["NetIncome"], p["Assets"])
+        if name == "DebtRatio":
+            return _ratio(p["Liabilities"], p["Assets"])
+        if name == "DebtToEquity":
+            equity = p["Assets"] - p["Liabilities"]
+            return _ratio(p["Liabilities"], equity.where(equity > 0))
+        if name == "RevenueYoY":
+            prev = p["Revenues"].shift(1)
+            return _ratio(p["Revenues"], prev.where(prev > 0)) - 1
+        if name == "NetIncomeYoY":
+            prev = p["NetIncome"].shift(1)
+            return _ratio(p["NetIncome"] - prev, prev.abs())
+        if name == "RevenueCAGR3Y":
+            return _cagr(p["Revenues"], 3)
+        if name == "RevenueCAGR5Y":
+            return _cagr(p["Revenues"], 5)
+        raise KeyError(name)
+
+    out = {}
+    for name in metrics:
+        needs = DERIVED_METRICS[name][1]
+        if all(n in p for n in needs):
+            out[name] = compute(name).replace([np.inf, -np.inf], np.nan)
+    return out
+
+
+def derived_facts(facts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fact-store rows of every derived metric computable from `facts`
+    (base rows in FACT_COLUMNS, one or many companies).
+    """
+    cols = FACT_COLUMNS if "cik" in facts.columns else [c for c in FACT_COLUMNS if c != "cik"]
+    if facts.empty:
+        return pd.DataFrame(columns=cols)
+    facts = facts.assign(cik=facts["cik"] if "cik" in facts.columns else "")
+    facts = facts[facts["fy"].notna() & facts["val"].notna()]
+    facts = facts.astype({"fy": "int64", "val": "float64"})
+
+    # One pivot for every concept and company, one gather back to rows
+    wide = facts.pivot_table(index="fy", columns=["concept", "cik"], values="val", aggfunc="last")
+    panels = {c: wide.xs(c, axis=1, level="concept") for c in wide.columns.get_level_values("concept").unique()}
+    derived = derived_panels(panels)
+    if not derived:
+        return pd.DataFrame(columns=cols)
+    stacked = pd.concat(derived, axis=1, names=["concept", "cik"])
+    vals = stacked.to_numpy()
+    rows, idx = np.nonzero(~np.isnan(vals))
+    long = pd.DataFrame({
+        "cik": stacked.columns.get_level_values("cik")[idx],
+        "concept": stacked.columns.get_level_values("concept")[idx],
+        "fy": stacked.index.to_numpy()[rows],
+        "val": vals[rows, idx],
+    })
+    long["tag"] = long["concept"].map({k: v[0] for k, v in DERIVED_METRICS.items()})
+    long["fp"] = "FY"
+    long["unit"] = "ratio"
+    long["form"] = "10-K"
+    # Period end of a derived value: the latest base period end of that company-year
+    ends = facts.groupby(["cik", "fy"])["end"].max()
+    long["end"] = ends.reindex(pd.MultiIndex.from_frame(long[["cik", "fy"]])).to_numpy()
+    return long.reindex(columns=cols)
+
+
+def backfill_derived(ciks=None) -> int:
+    """
+    Recomputes the derived rows of stored companies (all by default) from
+    their stored base facts. Returns the number of companies rewritten.
+    """
+    # Every stored base concept: a company's rows are replaced as a whole
+    base = [c for c in list_concepts() if c not in DERIVED_METRICS]
+    ciks = sorted(stored_companies()) if ciks is None else list(ciks)
+    if not ciks:
+        return 0
+    facts = query_facts(base, ciks, form=None)
+    derived = derived_facts(facts)
+
+    for cik, rows in pd.concat([facts, derived], ignore_index=True).groupby("cik"):
+        write_company_facts(cik, rows)
+    flush()
+    print(f"🧮 Derived metrics recomputed for {facts['cik'].nunique()} companies")
+    return int(facts["cik"].nunique())
+
+
+if __name__ == "__main__":
+    backfill_derived()
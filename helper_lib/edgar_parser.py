@@ -1,50 +1,165 @@
 # helper_lib/edgar_parser.py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-import requests
 import pandas as pd
-from .utils import SEC_HEADERS, RAW_DIR, normalize_cik, clean_html_text, chunk_text
+from .utils import normalize_cik, chunk_texts
+from . import raw_store
+from .html_text import html_file_to_text
+from .sec_client import sec_get, fetch_many
+from .sec_cache import cached_fetch
+from .sections import split_sections
+
+# Worker processes for the CPU-bound parse + chunk step (1 = in-process)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Seconds a cached submissions list is used without asking SEC
+SUBMISSIONS_MAX_AGE = float(os.getenv("SUBMISSIONS_MAX_AGE", "600"))
+SUBMISSION_COLUMNS = ("accessionNumber", "filingDate", "reportDate", "form", "primaryDocument")
+
+# Sections left out of the index entirely, e.g. "Cover,Item 15"
+SKIP_SECTIONS = {s.strip() for s in os.getenv("INDEX_SKIP_SECTIONS", "").split(",") if s.strip()}
+
+def _parse_submissions(resp) -> pd.DataFrame:
+    recent = resp.json()["filings"]["recent"]
+    # Only the columns ingestion reads, not the ~15 in the `recent` block
+    return pd.DataFrame({col: recent.get(col, []) for col in SUBMISSION_COLUMNS})
 
 def get_company_filings(cik: str) -> pd.DataFrame:
+    """
+    The company's recent filings list. Served from data/sec_cache for
+    SUBMISSIONS_MAX_AGE seconds, then revalidated with a conditional GET.
+    """
     cik = normalize_cik(cik)
     url = f"https://data.sec.gov/submissions/CIK{cik}.json"
-    r = requests.get(url, headers=SEC_HEADERS)
-    r.raise_for_status()
-    data = r.json()
-    return pd.DataFrame(data["filings"]["recent"])
+    return cached_fetch("submissions", cik, url, _parse_submissions,
+                        max_age=SUBMISSIONS_MAX_AGE, fmt="parquet")
 
-def build_chunks_for_filings(cik: str, form_types=("10-K",), limit_per_form=3) -> pd.DataFrame:
-    cik = normalize_cik(cik)
+def select_filings(cik: str, form_types=("10-K",), limit_per_form=3) -> pd.DataFrame:
+    """The most recent filings of the given forms, as listed by SEC."""
     df = get_company_filings(cik)
-    
-    # Filter forms
-    df = df[df["form"].isin(form_types)].head(limit_per_form)
-    
-    all_chunks = []
-    
-    for _, row in df.iterrows():
-        acc = row["accessionNumber"].replace("-", "")
-        doc = row["primaryDocument"]
-        url = f"https://www.sec.gov/Archives/edgar/data/{cik}/{acc}/{doc}"
-        
-        # Download
-        save_path = RAW_DIR / f"{acc}.html"
-        if not save_path.exists():
-            resp = requests.get(url, headers=SEC_HEADERS)
-            save_path.write_text(resp.text, encoding="utf-8", errors="ignore")
-            
-        # Parse & Chunk
-        raw_text = save_path.read_text(encoding="utf-8", errors="ignore")
-        clean_text = clean_html_text(raw_text)
-        chunks = chunk_text(clean_text)
-        
-        for i, txt in enumerate(chunks):
-            all_chunks.append({
-                "chunk_id": f"{row['accessionNumber']}_{i}",
+    return df[df["form"].isin(form_types)].head(limit_per_form)
+
+# -----------------------------
+# Download / parse
+# -----------------------------
+def download_filing(cik: str, row) -> Path:
+    """Saves a filing's primary document in the raw store (once) and returns its path."""
+    acc = row["accessionNumber"].replace("-", "")
+    doc = row["primaryDocument"]
+    url = f"https://www.sec.gov/Archives/edgar/data/{cik}/{acc}/{doc}"
+
+    save_path = raw_store.find_raw(cik, acc, doc)
+    if save_path is None:
+        resp = sec_get(url)
+        resp.raise_for_status()
+        save_path = raw_store.write_raw(cik, acc, doc, resp.text)
+    return save_path
+
+def download_filings(jobs) -> list:
+    """
+    Downloads (cik, row) pairs concurrently through the shared SEC client
+    and returns their paths in order.
+    """
+    return fetch_many(jobs, lambda job: download_filing(*job))
+
+def _skip_sections(sections: list, accession: str) -> list:
+    """
+    Drops SKIP_SECTIONS, except a Cover holding most of the filing: that
+    means its Item headings were not recognised, and skipping it would
+    silently drop the whole body.
+    """
+    total = sum(len(body) for _, body in sections) or 1
+    kept = []
+    for name, body in sections:
+        if name in SKIP_SECTIONS:
+            if name != "Cover" or len(body) <= total / 2:
+                continue
+            print(f"⚠️ {accession}: Cover is {len(body) / total:.0%} of the filing (Item headings not found), indexing it anyway")
+        kept.append((name, body))
+    return kept
+
+def parse_filing(path, cik: str, accession: str, form: str, filing_date: str, primary_doc: str) -> list:
+    """
+    Cleans and chunks one saved filing into chunk rows. Module-level and
+    argument-only so it can run in a worker process.
+    """
+    clean_text = html_file_to_text(path)
+
+    sections = _skip_sections(split_sections(clean_text, form), accession)
+    # Chunk each Item separately so no chunk straddles two sections
+    section_chunks = chunk_texts([body for _, body in sections])
+
+    rows = []
+    for (section, _), chunks in zip(sections, section_chunks):
+        for txt in chunks:
+            rows.append({
+                "chunk_id": f"{accession}_{len(rows)}",
                 "cik": cik,
-                "accession": row["accessionNumber"],
-                "filing_date": row["filingDate"],
-                "primary_doc": row["primaryDocument"], # <--- Ensures filenames are saved for links
+                "accession": accession,
+                "form": form,
+                "filing_date": filing_date,
+                "primary_doc": primary_doc, # <--- Ensures filenames are saved for links
+                "section": section,
                 "text": txt
             })
-            
-    return pd.DataFrame(all_chunks)
\ No newline at end of file
+    return rows
+
+def parse_job_args(cik: str, row, path: Path) -> tuple:
+    """parse_filing arguments for a select_filings row saved at `path`."""
+    return (str(path), cik, row["accessionNumber"], row["form"], row["filingDate"], row["primaryDocument"])
+
+def parse_workers(n_jobs: int, workers: int = None) -> int:
+    workers = PARSE_WORKERS if workers is None else workers
+    return max(1, min(workers, n_jobs))
+
+def _pool_context():
+    # Ingest runs on job threads: forking a threaded process can copy held
+    # locks (logging, HTTP pools, BLAS) into the child. forkserver children
+    # start from a clean single-threaded server instead.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def iter_parsed_filings(jobs, workers: int = None):
+    """
+    Parses (key, args) jobs, args as for parse_filing, and yields
+    (key, chunk_rows) as each one finishes. With more than one worker the
+    filings are spread over a process pool, so callers can start embedding
+    the first results while the rest are still being parsed.
+    """
+    jobs = list(jobs)
+    workers = parse_workers(len(jobs), workers)
+    if workers == 1:
+        for key, args in jobs:
+            yield key, parse_filing(*args)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+    try:
+        futures = {pool.submit(parse_filing, *args): key for key, args in jobs}
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
+    finally:
+        # Drop queued filings if the caller stops early (error, cancelled job)
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def build_chunks_for_filings(cik: str, form_types=("10-K",), limit_per_form=3, filings: pd.DataFrame = None,
+                             workers: int = None) -> pd.DataFrame:
+    """
+    Downloads, cleans and chunks filings. Pass `filings` (rows from
+    select_filings) to process a specific subset, e.g. only new accessions.
+    Parsing runs in a process pool when PARSE_WORKERS (or `workers`) > 1.
+    """
+    cik = normalize_cik(cik)
+    if filings is None:
+        filings = select_filings(cik, form_types, limit_per_form)
+
+    rows = [row for _, row in filings.iterrows()]
+    paths = download_filings([(cik, row) for row in rows])
+    jobs = [(pos, parse_job_args(cik, row, path)) for pos, (row, path) in enumerate(zip(rows, paths))]
+
+    # Keep the filings' order regardless of which finishes first
+    parsed = dict(iter_parsed_filings(jobs, workers))
+    all_chunks = [c for pos in sorted(parsed) for c in parsed[pos]]
+    return pd.DataFrame(all_chunks)
@@ -0,0 +1,169 @@
+# helper_lib/embed_cache.py
+
+"""
+Content-addressed on-disk cache of chunk embeddings.
+
+Each embedding model gets three files under EMBED_CACHE_DIR:
+- {model}.f32   raw float32 rows, appended in insertion order
+- {model}.keys  16-byte blake2b digests of (model, text), one per row
+- {model}.json  {"dim": ...}
+
+Vectors are read through a read-only memmap, so a lookup only touches the
+rows it returns. Re-ingesting a filing whose text has not changed then
+needs no embedding API calls at all.
+
+Appends hold an flock on {model}.lock as well as the thread lock: several
+uvicorn workers can ingest at once, and an unserialised reload → truncate
+→ append sequence could pair keys with another process's vectors.
+Readers need no lock since they only map rows whose key is complete.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from .utils import EMBED_CACHE_DIR, file_lock
+
+_KEY_BYTES = 16
+_lock = threading.Lock()
+# model -> {"sig", "dim", "keys_sorted", "order", "vectors"}
+_state = {}
+
+
+def _paths(model: str):
+    return (
+        EMBED_CACHE_DIR / f"{model}.f32",
+        EMBED_CACHE_DIR / f"{model}.keys",
+        EMBED_CACHE_DIR / f"{model}.json",
+    )
+
+
+def _lock_path(model: str):
+    return EMBED_CACHE_DIR / f"{model}.lock"
+
+
+def hash_texts(model: str, texts: list) -> np.ndarray:
+    """Content keys for `texts` as an array of fixed-width 16-byte digests."""
+    prefix = model.encode("utf-8") + b"\0"
+    digests = [
+        hashlib.blake2b(prefix + t.encode("utf-8"), digest_size=_KEY_BYTES).digest()
+        for t in texts
+    ]
+    return np.array(digests, dtype=f"S{_KEY_BYTES}")
+
+
+def _load_locked(model: str):
+    vec_path, keys_path, meta_path = _paths(model)
+    if not meta_path.exists() or not keys_path.exists():
+        return None
+
+    sig = (vec_path.stat().st_size, keys_path.stat().st_size)
+    cached = _state.get(model)
+    if cached is not None and cached["sig"] == sig:
+        return cached
+
+    dim = json.loads(meta_path.read_text())["dim"]
+    # Rows are only complete once both the vector and its key are written.
+    rows = min(sig[0] // (4 * dim), sig[1] // _KEY_BYTES)
+    if rows == 0:
+        return None
+
+    keys = np.fromfile(keys_path, dtype=f"S{_KEY_BYTES}", count=rows)
+    vectors = np.memmap(vec_path, dtype="float32", mode="r", shape=(rows, dim))
+    order = np.argsort(keys, kind="stable")
+
+    cached = {
+        "sig": sig,
+        "dim": dim,
+        "keys_sorted": keys[order],
+        "order": order,
+        "vectors": vectors,
+    }
+    _state[model] = cached
+    return cached
+
+
+def _find(state, keys: np.ndarray):
+    """Returns (found mask, row numbers) for `keys` against the loaded state."""
+    sk = state["keys_sorted"]
+    pos = np.minimum(np.searchsorted(sk, keys), len(sk) - 1)
+    found = sk[pos] == keys
+    return found, state["order"][pos]
+
+
+def get_many(model: str, texts: list):
+    """
+    Looks up cached embeddings.
+    Returns (vectors, found): vectors is a (len(texts), dim) float32 array
+    (or None when the cache is empty) whose rows are valid where found[i].
+    """
+    found = np.zeros(len(texts), dtype=bool)
+    if not texts:
+        return None, found
+
+    keys = hash_texts(model, texts)
+    with _lock:
+        state = _load_locked(model)
+    if state is None:
+        return None, found
+
+    found, rows = _find(state, keys)
+    out = np.zeros((len(texts), state["dim"]), dtype="float32")
+    out[found] = state["vectors"][rows[found]]
+    return out, found
+
+
+def put_many(model: str, texts: list, vectors: np.ndarray):
+    """Appends embeddings for texts not already in the cache."""
+    if not texts:
+        return
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    keys = hash_texts(model, texts)
+
+    # Drop duplicates inside this call, keeping the first occurrence.
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    keys, vectors = keys[first], vectors[first]
+
+    vec_path, keys_path, meta_path = _paths(model)
+    dim = int(vectors.shape[1])
+    with _lock, file_lock(_lock_path(model)):
+        # Reloaded under the file lock: another process may have appended
+        state = _load_locked(model)
+        rows = 0
+        if state is not None:
+            if state["dim"] != dim:
+                raise ValueError(
+                    f"Embedding cache for {model} has dim {state['dim']}, got {dim}"
+                )
+            rows = len(state["order"])
+            found, _ = _find(state, keys)
+            keys, vectors = keys[~found], vectors[~found]
+        if len(keys) == 0:
+            return
+
+        if state is None:
+            meta_path.write_text(json.dumps({"dim": dim}))
+        # Drop any half-written tail from an interrupted earlier append so
+        # vector row i and key i stay aligned.
+        for path, size in ((vec_path, rows * 4 * dim), (keys_path, rows * _KEY_BYTES)):
+            if path.exists() and path.stat().st_size != size:
+                os.truncate(path, size)
+
+        # Vectors first: a crash between the writes leaves an orphan vector
+        # tail that _load_locked ignores, never a key without its vector.
+        with vec_path.open("ab") as f:
+            f.write(vectors.tobytes())
+        with keys_path.open("ab") as f:
+            f.write(keys.tobytes())
+
+
+def cache_stats(model: str) -> dict:
+    with _lock:
+        state = _load_locked(model)
+    if state is None:
+        return {"model": model, "rows": 0}
+    return {"model": model, "rows": int(len(state["order"])), "dim": int(state["dim"])}
@@ -0,0 +1,188 @@
+# helper_lib/embedder.py
+
+"""
+Embedding backends.
+
+Every backend exposes `name` (used to key the embedding cache), `dim`
+and `embed(texts) -> (n, dim) float32 array`. The active backend comes
+from EMBED_BACKEND:
+- openai  text-embedding-3-small via the OpenAI API (default)
+- hash    deterministic hashed word/bigram vectorizer in pure NumPy, for
+          offline benchmarking and CI; no network or API key needed
+"""
+
+import base64
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from .utils import _tokenizer
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "openai")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+HASH_EMBED_DIM = int(os.getenv("HASH_EMBED_DIM", "512"))
+
+# Embedding request sizing / concurrency (OpenAI backend)
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "200000"))
+EMBED_BATCH_MAX_INPUTS = 2048  # API limit on inputs per request
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+_OPENAI_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class OpenAIEmbedder:
+    """Token-budgeted, concurrent batches against the embeddings API."""
+
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+        self.name = model
+        self.dim = _OPENAI_DIMS.get(model, 1536)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use so importing the retriever needs no API key.
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI()
+        return self._client
+
+    def _token_batches(self, texts: list) -> list:
+        """
+        Splits texts into (start, end) ranges whose token total stays under
+        EMBED_BATCH_TOKENS. A single oversized text still gets its own batch.
+        """
+        lengths = [len(t) for t in _tokenizer.encode_ordinary_batch(texts)]
+        batches = []
+        start, used = 0, 0
+        for i, n_tok in enumerate(lengths):
+            full = (i - start) >= EMBED_BATCH_MAX_INPUTS or used + n_tok > EMBED_BATCH_TOKENS
+            if i > start and full:
+                batches.append((start, i))
+                start, used = i, 0
+            used += n_tok
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _embed_batch(self, texts: list) -> list:
+        """One embeddings call with exponential backoff on transient errors."""
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+        retryable = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                resp = self.client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    encoding_format="base64"
+                )
+                return resp.data
+            except retryable:
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                time.sleep(min(30.0, 2 ** attempt) + random.uniform(0, 0.5))
+
+    def embed(self, texts: list) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype="float32")
+        if not texts:
+            return out
+
+        t0 = time.perf_counter()
+        batches = self._token_batches(texts)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(EMBED_WORKERS, len(batches)))) as pool:
+            futures = {pool.submit(self._embed_batch, texts[a:b]): a for a, b in batches}
+            for fut in as_completed(futures):
+                offset = futures[fut]
+                for d in fut.result():
+                    out[offset + d.index] = np.frombuffer(base64.b64decode(d.embedding), dtype="<f4")
+
+        if len(texts) > 1:
+            dt = time.perf_counter() - t0
+            print(
+                f"🧮 Embedded {len(texts)} texts in {len(batches)} batches "
+                f"({dt:.1f}s, {len(texts) / max(dt, 1e-9):.0f} texts/sec)"
+            )
+        return out
+
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """
+    Signed feature hashing of lowercase words and word bigrams into `dim`
+    buckets, log-scaled and L2-normalized. Deterministic across processes
+    (crc32, not Python's salted hash), so indexes built with it are
+    reproducible.
+    """
+
+    def __init__(self, dim: int = HASH_EMBED_DIM):
+        self.dim = dim
+        self.name = f"hash-ngram-{dim}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        n = len(texts)
+        out = np.zeros(n * self.dim, dtype="float32")
+        if not texts:
+            return out.reshape(0, self.dim)
+
+        word_hashes, feat_rows = [], []
+        for row, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            h = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype="uint64", count=len(words))
+            # Bigram hashes are derived arithmetically from the word hashes.
+            bigrams = (h[:-1] * np.uint64(1000003) + h[1:]) & np.uint64(0xFFFFFFFF)
+            word_hashes.append(np.concatenate([h, bigrams]))
+            feat_rows.append(np.full(len(h) + len(bigrams), row, dtype="int64"))
+
+        h = np.concatenate(word_hashes)
+        rows = np.concatenate(feat_rows)
+        buckets = (h % np.uint64(self.dim)).astype("int64")
+        signs = np.where(h & np.uint64(1 << 31), -1.0, 1.0).astype("float32")
+
+        out += np.bincount(rows * self.dim + buckets, weights=signs, minlength=n * self.dim).astype("float32")
+        out = out.reshape(n, self.dim)
+        out = np.sign(out) * np.log1p(np.abs(out))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return (out / np.maximum(norms, 1e-12)).astype("float32")
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """The process-wide embedding backend selected by EMBED_BACKEND."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            backend = EMBED_BACKEND.lower()
+            if backend == "openai":
+                _embedder = OpenAIEmbedder()
+            elif backend == "hash":
+                _embedder = HashingEmbedder()
+            else:
+                raise ValueError(f"Unknown EMBED_BACKEND '{EMBED_BACKEND}', expected 'openai' or 'hash'")
+        return _embedder
+
+
+def set_embedder(embedder):
+    """Swap the active backend at runtime (e.g. in benchmarks)."""
+    global _embedder
+    with _embedder_lock:
+        _embedder = embedder
@@ -0,0 +1,196 @@
+# helper_lib/fact_store.py
+
+"""
+Columnar store of XBRL facts across companies.
+
+One parquet file per concept (data/facts/{concept}.parquet) holding
+every company's rows:
+
+    cik | concept | tag | fy | fp | end | val | unit | form
+
+sorted by (cik, fy). A company is replaced as a block when its
+companyfacts are re-fetched (see xbrl.py), and data/facts/companies.parquet
+records which companies are present and when they were written. Writers
+in different processes take data/facts/facts.lock for the whole rewrite,
+so a company's rows cannot be lost from one concept file while
+companies.parquet still lists it.
+
+Concept tables are read once and cached in memory until the file changes.
+Panel queries ("Revenues for these CIKs over these years") are boolean
+masks plus a pivot over a few thousand rows, not one JSON parse per
+company.
+"""
+
+import atexit
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .utils import DATA_DIR, file_lock, normalize_cik
+
+FACTS_DIR = DATA_DIR / "facts"
+FACTS_DIR.mkdir(parents=True, exist_ok=True)
+
+FACT_COLUMNS = ["cik", "concept", "tag", "fy", "fp", "end", "val", "unit", "form"]
+_COMPANIES = FACTS_DIR / "companies.parquet"
+# Held by the process rewriting concept files (other uvicorn workers and
+# backfill scripts share the same files)
+_LOCK_PATH = FACTS_DIR / "facts.lock"
+
+_tables = {}   # path -> (file stamp, DataFrame)
+_pending = {}  # cik -> facts waiting to be written
+_lock = threading.Lock()
+
+
+def _concept_path(concept: str):
+    # Concept names become file names: never let one point outside FACTS_DIR
+    concept = str(concept)
+    if not concept or concept in (".", "..") or any(sep in concept for sep in ("/", "\\", "\0")):
+        raise ValueError(f"Invalid concept name {concept!r}")
+    path = FACTS_DIR / f"{concept}.parquet"
+    if path == _COMPANIES:
+        raise ValueError(f"Invalid concept name {concept!r}")
+    return path
+
+
+def _stamp(path):
+    # Every write is a rename, so a new inode means another process wrote it
+    # even if the mtime did not move
+    st = path.stat()
+    return st.st_mtime_ns, st.st_ino, st.st_size
+
+
+def _read(path, columns) -> pd.DataFrame:
+    try:
+        stamp = _stamp(path)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=columns)
+    cached = _tables.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    df = pd.read_parquet(path)
+    _tables[path] = (stamp, df)
+    return df
+
+
+def _write(path, df: pd.DataFrame):
+    tmp = path.with_name(path.name + ".tmp")
+    df.to_parquet(tmp, index=False)
+    tmp.replace(path)
+    _tables[path] = (_stamp(path), df)
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reindex(columns=FACT_COLUMNS)
+    df = df[df["fy"].notna()]
+    return df.astype({
+        "cik": str, "concept": str, "tag": str, "fy": "int64", "fp": str,
+        "end": str, "val": "float64", "unit": str, "form": str,
+    })
+
+
+def list_concepts() -> list:
+    return sorted(p.stem for p in FACTS_DIR.glob("*.parquet") if p != _COMPANIES)
+
+
+def load_concept(concept: str) -> pd.DataFrame:
+    """All companies' rows for one concept (cached until the file changes)."""
+    with _lock:
+        _flush()
+        return _read(_concept_path(concept), FACT_COLUMNS)
+
+
+def stored_companies() -> set:
+    with _lock:
+        return set(_read(_COMPANIES, ["cik", "updated_at"])["cik"]) | set(_pending)
+
+
+def write_company_facts(cik: str, facts: pd.DataFrame):
+    """
+    Replaces every stored fact of `cik` with `facts` (FACT_COLUMNS rows).
+    Writes are buffered and applied in one pass per concept file before the
+    next read, so filling hundreds of companies rewrites each file once.
+    """
+    cik = normalize_cik(cik)
+    facts = _normalize(facts.assign(cik=cik))
+    with _lock:
+        _pending[cik] = facts
+
+
+def flush():
+    with _lock:
+        _flush()
+
+
+atexit.register(flush)
+
+
+def _flush():
+    if not _pending:
+        return
+    ciks = list(_pending)
+    facts = pd.concat(_pending.values(), ignore_index=True)
+    _pending.clear()
+
+    # Read-modify-write of shared files: without the file lock, two processes
+    # flushing at once each rewrite a concept file from their own read and
+    # one drops the other's companies, while companies.parquet lists both.
+    with file_lock(_LOCK_PATH):
+        _merge(ciks, facts)
+
+
+def _merge(ciks: list, facts: pd.DataFrame):
+    """Replaces `ciks` in every concept file and in companies.parquet (file lock held)."""
+    for concept in set(facts["concept"]) | set(list_concepts()):
+        path = _concept_path(concept)
+        old = _read(path, FACT_COLUMNS)
+        new = facts[facts["concept"] == concept]
+        kept = old[~old["cik"].isin(ciks)]
+        if len(kept) == len(old) and new.empty:
+            continue
+        df = pd.concat([kept, new], ignore_index=True) if len(kept) else new
+        _write(path, df.sort_values(["cik", "fy"], kind="stable").reset_index(drop=True))
+
+    companies = _read(_COMPANIES, ["cik", "updated_at"])
+    companies = pd.concat([
+        companies[~companies["cik"].isin(ciks)],
+        pd.DataFrame({"cik": ciks, "updated_at": time.time()}),
+    ], ignore_index=True)
+    _write(_COMPANIES, companies)
+
+
+def query_facts(concepts, ciks=None, years=None, form: str = "10-K") -> pd.DataFrame:
+    """Long-format rows for the given concepts, filtered by cik / fiscal year / form."""
+    frames = []
+    for concept in concepts:
+        df = load_concept(concept)
+        if df.empty:
+            continue
+        mask = np.ones(len(df), dtype=bool)
+        if ciks is not None:
+            mask &= df["cik"].isin([normalize_cik(c) for c in ciks]).to_numpy()
+        if years is not None:
+            mask &= df["fy"].isin(list(years)).to_numpy()
+        if form:
+            mask &= (df["form"] == form).to_numpy()
+        frames.append(df[mask])
+    if not frames:
+        return pd.DataFrame(columns=FACT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def panel(concept: str, ciks, years=None, form: str = "10-K") -> pd.DataFrame:
+    """fy × cik matrix of values for one concept (NaN where missing)."""
+    ciks = [normalize_cik(c) for c in ciks]
+    df = query_facts([concept], ciks, years, form)
+    if df.empty:
+        out = pd.DataFrame(columns=ciks, dtype="float64")
+    else:
+        out = df.pivot_table(index="fy", columns="cik", values="val", aggfunc="last")
+    out = out.reindex(columns=ciks)
+    if years is not None:
+        out = out.reindex(sorted(years))
+    out.index.name = "fy"
+    return out.sort_index()
@@ -0,0 +1,119 @@
+# helper_lib/filters.py
+
+"""
+Precomputed filter arrays for metadata pre-filtering inside FAISS.
+
+For each filterable column the ingest step stores, CSR-style:
+- {col}_values  sorted distinct values
+- {col}_ptr     rows with values[i] live in rows[ptr[i]:ptr[i+1]]
+- {col}_rows    chunk row numbers grouped by value (sorted within a group)
+
+Because values are sorted, a filing-date range is one contiguous slice of
+{col}_rows, and a set of accessions is a few slices. The resulting sorted
+row array becomes a FAISS IDSelector, so filtering happens during the
+vector scan instead of on a DataFrame afterwards.
+
+Supported filters (all optional, combined with AND):
+    date_from / date_to  inclusive ISO dates on filing_date
+    latest_only          only the most recent filing_date
+    accessions           list of accession numbers
+    forms                list of form types
+    sections             list of section labels ("Item 1A") or names
+                         ("risk factors", "MD&A"), see sections.py
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .sections import expand_sections
+
+FILTER_COLUMNS = ("filing_date", "accession", "form", "section")
+
+_LIST_FILTERS = {"accessions": "accession", "forms": "form", "sections": "section"}
+
+
+def build_filter_index(meta_df: pd.DataFrame) -> dict:
+    arrays = {}
+    for col in FILTER_COLUMNS:
+        if col not in meta_df.columns:
+            continue
+        values = np.asarray(meta_df[col].astype(str).to_numpy(), dtype=str)
+        order = np.argsort(values, kind="stable")
+        uniq, counts = np.unique(values[order], return_counts=True)
+        ptr = np.zeros(len(uniq) + 1, dtype="int64")
+        ptr[1:] = np.cumsum(counts)
+        arrays[f"{col}_values"] = uniq
+        arrays[f"{col}_ptr"] = ptr
+        arrays[f"{col}_rows"] = order.astype("int64")
+    arrays["n_rows"] = np.array([len(meta_df)], dtype="int64")
+    return arrays
+
+
+def save_filter_index(fidx: dict, path: Path):
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp, **fidx)
+    tmp.replace(path)
+
+
+def load_filter_index(path: Path) -> dict:
+    with np.load(path) as z:
+        return {name: z[name] for name in z.files}
+
+
+def filter_index_nbytes(fidx: dict) -> int:
+    return int(sum(a.nbytes for a in fidx.values()))
+
+
+def _slice_rows(fidx: dict, col: str, lo: int, hi: int) -> np.ndarray:
+    ptr = fidx[f"{col}_ptr"]
+    return np.sort(fidx[f"{col}_rows"][ptr[lo]:ptr[hi]])
+
+
+def _rows_for_values(fidx: dict, col: str, wanted: list) -> np.ndarray:
+    values = fidx[f"{col}_values"]
+    wanted = np.array(sorted(set(map(str, wanted))))
+    lo = np.searchsorted(values, wanted, side="left")
+    hi = np.searchsorted(values, wanted, side="right")
+    parts = [_slice_rows(fidx, col, a, b) for a, b in zip(lo, hi) if b > a]
+    if not parts:
+        return np.zeros(0, dtype="int64")
+    return np.sort(np.concatenate(parts))
+
+
+def allowed_rows(fidx: dict, filters: dict):
+    """
+    Sorted chunk rows matching `filters`, or None when nothing restricts
+    the search. Filters on a column this company's metadata lacks (e.g.
+    section, for filings ingested before it existed) are ignored.
+    """
+    if not filters or fidx is None:
+        return None
+
+    result = None
+
+    def narrow(rows):
+        nonlocal result
+        result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+
+    has_dates = "filing_date_values" in fidx
+    date_from, date_to = filters.get("date_from"), filters.get("date_to")
+    if has_dates and (date_from or date_to):
+        values = fidx["filing_date_values"]
+        lo = np.searchsorted(values, str(date_from), side="left") if date_from else 0
+        hi = np.searchsorted(values, str(date_to), side="right") if date_to else len(values)
+        narrow(_slice_rows(fidx, "filing_date", lo, max(lo, hi)))
+
+    if has_dates and filters.get("latest_only"):
+        n = len(fidx["filing_date_values"])
+        narrow(_slice_rows(fidx, "filing_date", max(n - 1, 0), n))
+
+    for key, col in _LIST_FILTERS.items():
+        wanted = filters.get(key)
+        if wanted and key == "sections":
+            wanted = expand_sections(wanted)
+        if wanted and f"{col}_values" in fidx:
+            narrow(_rows_for_values(fidx, col, wanted))
+
+    return result
@@ -0,0 +1,222 @@
+# helper_lib/html_text.py
+
+"""
+Streaming HTML -> text for filing documents.
+
+`clean_html_text` (utils.py) builds a full BeautifulSoup tree with the pure
+Python html.parser, rewrites every <table> and then walks the tree again for
+get_text. On 10-K sized documents (10-80 MB of inline XBRL) that is the
+slowest step of ingest and holds several copies of the document in memory.
+
+`html_to_text` produces the same output from lxml's C parser driven through a
+SAX-style target: no tree is built, the file is fed in blocks, and text is
+emitted as the parser walks the document. Semantics mirror the BeautifulSoup
+version exactly:
+- every text node is one line of the joined text (script/style/comments are
+  skipped, as get_text does)
+- a table becomes "[TABLE START]" / pipe-delimited rows / "[TABLE END]";
+  rows are every <tr> inside it and cells every <td>/<th> inside the row,
+  nested ones included, each cell being its stripped strings concatenated
+- blank-line runs are collapsed the same way
+
+HTML_PARSER=bs4 switches back to the BeautifulSoup path; it is also used when
+lxml is not installed. `compare_extractors` checks parity and timings on the
+downloaded filings.
+"""
+
+import os
+import re
+import time
+from pathlib import Path
+
+from .raw_store import open_text, read_text, iter_raw
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover - optional speedup
+    etree = None
+
+HTML_PARSER = os.getenv("HTML_PARSER", "lxml").lower()
+READ_BLOCK_BYTES = 1 << 20
+
+_SKIP_TAGS = {"script", "style", "template"}
+_CELL_TAGS = {"td", "th"}
+
+
+class _TextTarget:
+    """lxml parser target that accumulates the get_text()-equivalent output."""
+
+    def __init__(self):
+        self.parts = []       # text nodes of the document, in order
+        self._buf = []        # data() pieces of the current text node
+        self._skip = 0        # depth inside script/style
+        self._table = 0       # depth inside <table>
+        self._rows = []       # [cells] per <tr> of the current top-level table, in start order
+        self._open_rows = []  # indices into _rows of the open <tr>s
+        self._open_cells = [] # buffers of the open <td>/<th>s
+
+    def _flush(self):
+        if not self._buf:
+            return
+        s = "".join(self._buf)
+        self._buf = []
+        if self._table:
+            s = s.strip()
+            if s:
+                for cell in self._open_cells:
+                    cell.append(s)
+        else:
+            self.parts.append(s)
+
+    def start(self, tag, attrib):
+        self._flush()
+        tag = tag.lower() if isinstance(tag, str) else tag
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag == "table":
+            self._table += 1
+        elif self._table and tag == "tr":
+            self._open_rows.append(len(self._rows))
+            self._rows.append([])
+        elif self._table and tag in _CELL_TAGS:
+            cell = []
+            for r in self._open_rows:
+                self._rows[r].append(cell)
+            self._open_cells.append(cell)
+
+    def end(self, tag):
+        self._flush()
+        tag = tag.lower() if isinstance(tag, str) else tag
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag == "table" and self._table:
+            self._table -= 1
+            if not self._table:
+                self._emit_table()
+        elif self._table and tag == "tr" and self._open_rows:
+            self._open_rows.pop()
+        elif self._table and tag in _CELL_TAGS and self._open_cells:
+            self._open_cells.pop()
+
+    def data(self, text):
+        if not self._skip:
+            self._buf.append(text)
+
+    def comment(self, text):
+        self._flush()
+
+    def pi(self, target, data=None):
+        self._flush()
+
+    def close(self):
+        self._flush()
+        if self._table:
+            self._emit_table()
+        return "\n".join(self.parts)
+
+    def _emit_table(self):
+        rows_text = []
+        for cells in self._rows:
+            texts = ["".join(c) for c in cells]
+            if any(texts):
+                rows_text.append(" | ".join(texts))
+        self.parts.append("\n[TABLE START]\n" + "\n".join(rows_text) + "\n[TABLE END]\n")
+        self._table = 0
+        self._rows, self._open_rows, self._open_cells = [], [], []
+
+
+def _finish(text: str) -> str:
+    text = re.sub(r"\n\s*\n", "\n\n", text)
+    return text.strip()
+
+
+def _new_parser(target):
+    return etree.HTMLParser(target=target, huge_tree=True, remove_comments=False)
+
+
+def _use_lxml() -> bool:
+    return etree is not None and HTML_PARSER != "bs4"
+
+
+def html_to_text(html_content: str) -> str:
+    """Same output as clean_html_text, without building a tree."""
+    if not _use_lxml():
+        from .utils import clean_html_text
+        return clean_html_text(html_content)
+    target = _TextTarget()
+    parser = _new_parser(target)
+    for i in range(0, len(html_content), READ_BLOCK_BYTES):
+        parser.feed(html_content[i:i + READ_BLOCK_BYTES])
+    if not html_content:
+        parser.feed(" ")
+    return _finish(parser.close())
+
+
+def html_file_to_text(path) -> str:
+    """Streams a stored filing (compressed or not) through the parser block by block."""
+    if not _use_lxml():
+        from .utils import clean_html_text
+        return clean_html_text(read_text(path))
+    target = _TextTarget()
+    parser = _new_parser(target)
+    fed = False
+    with open_text(path) as f:
+        while True:
+            block = f.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            parser.feed(block)
+            fed = True
+    if not fed:
+        parser.feed(" ")
+    return _finish(parser.close())
+
+
+# --- Parity / benchmark ---
+
+def compare_extractors(paths=None, limit: int = 20) -> dict:
+    """
+    Runs clean_html_text and html_to_text on stored filings (the raw store
+    by default) and reports per-file parity plus total timings.
+    """
+    from .utils import clean_html_text
+
+    if paths is None:
+        paths = list(iter_raw())[:limit]
+    report = {"files": [], "bs4_seconds": 0.0, "lxml_seconds": 0.0, "mismatches": 0}
+    for p in paths:
+        p = Path(p)
+        html = read_text(p)
+
+        t0 = time.perf_counter()
+        ref = clean_html_text(html)
+        t1 = time.perf_counter()
+        out = html_file_to_text(p)
+        t2 = time.perf_counter()
+
+        same = ref == out
+        # html.parser and libxml2 can disagree on whitespace-only nodes around
+        # malformed markup; report those separately from content differences.
+        same_words = same or ref.split() == out.split()
+        report["files"].append({
+            "file": p.name,
+            "mb": round(len(html) / 1e6, 2),
+            "bs4_s": round(t1 - t0, 3),
+            "lxml_s": round(t2 - t1, 3),
+            "identical": same,
+            "same_words": same_words,
+        })
+        report["bs4_seconds"] += t1 - t0
+        report["lxml_seconds"] += t2 - t1
+        report["mismatches"] += int(not same_words)
+
+    if report["lxml_seconds"]:
+        report["speedup"] = round(report["bs4_seconds"] / report["lxml_seconds"], 1)
+    print(f"🧪 HTML extractors on {len(paths)} files: bs4 {report['bs4_seconds']:.2f}s, "
+          f"lxml {report['lxml_seconds']:.2f}s, {report['mismatches']} content mismatches")
+    return report
+
+
+if __name__ == "__main__":
+    for row in compare_extractors()["files"]:
+        print(row)
@@ -0,0 +1,216 @@
+# helper_lib/index_types.py
+
+"""
+FAISS index construction and per-query search parameters.
+
+Supported types:
+- flat      exact IndexFlatL2 (the original behaviour)
+- hnsw      IndexHNSWFlat graph, tuned at query time with efSearch
+- ivf_flat  IndexIVFFlat, tuned at query time with nprobe
+- ivf_pq    IndexIVFPQ (product-quantized), tuned with nprobe
+
+"auto" picks one from corpus size. The chosen type and its parameters
+are returned as a small JSON-able dict that is stored next to the index
+so searches can build matching SearchParameters.
+
+Vectors in flat, HNSW and IVF-Flat indexes can be stored as float32 (the
+original), float16 or 8-bit scalar-quantized codes (VECTOR_STORAGE).
+With INDEX_MMAP=1, flat/HNSW/SQ indexes are opened memory-mapped so
+several uvicorn workers share one copy through the OS page cache.
+"""
+
+import os
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+
+# Corpus sizes (vectors) at which "auto" switches index type.
+AUTO_HNSW_MIN = int(os.getenv("AUTO_HNSW_MIN", "20000"))
+AUTO_IVF_PQ_MIN = int(os.getenv("AUTO_IVF_PQ_MIN", "500000"))
+
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+PQ_NBITS = 8
+
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32")
+INDEX_MMAP = os.getenv("INDEX_MMAP", "0") == "1"
+
+# FAISS k-means warns below ~39 training points per centroid.
+_MIN_POINTS_PER_CENTROID = 39
+_TRAIN_POINTS_PER_CENTROID = 256
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+STORAGE_TYPES = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def choose_index_type(n: int, index_type: str = None, removable: bool = False) -> str:
+    """
+    Resolves "auto" (or None → INDEX_TYPE) to a concrete type for n vectors.
+    removable=True restricts the choice to types supporting remove_ids
+    (HNSW does not), as needed by the global index.
+    """
+    index_type = (index_type or INDEX_TYPE).lower()
+    if index_type != "auto" and index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    if index_type == "auto":
+        if n >= AUTO_IVF_PQ_MIN:
+            index_type = "ivf_pq"
+        elif n >= AUTO_HNSW_MIN:
+            index_type = "ivf_flat" if removable else "hnsw"
+        else:
+            index_type = "flat"
+
+    if removable and index_type == "hnsw":
+        index_type = "ivf_flat"
+
+    # IVF needs enough points to train its coarse quantizer (and PQ codebooks).
+    if index_type == "ivf_pq" and n < _MIN_POINTS_PER_CENTROID * (1 << PQ_NBITS):
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and n < _MIN_POINTS_PER_CENTROID * 4:
+        index_type = "flat"
+    return index_type
+
+
+def _nlist_for(n: int) -> int:
+    nlist = int(4 * np.sqrt(n))
+    return max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID, 65536))
+
+
+def _pq_m_for(dim: int) -> int:
+    """Largest common sub-quantizer count that divides the dimension."""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _train_sample(vectors: np.ndarray, n_points: int) -> np.ndarray:
+    if len(vectors) <= n_points:
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[rng.choice(len(vectors), n_points, replace=False)]
+
+
+def build_index(vectors: np.ndarray, index_type: str = None, removable: bool = False,
+                storage: str = None):
+    """
+    Creates and trains (but does not fill) an index suited to `vectors`.
+    Returns (index, info) where info records the type and parameters.
+    """
+    n, dim = vectors.shape
+    index_type = choose_index_type(n, index_type, removable=removable)
+    storage = (storage or VECTOR_STORAGE).lower()
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage '{storage}', expected one of {tuple(STORAGE_TYPES)}")
+    if index_type == "ivf_pq" or n == 0:
+        storage = "float32"  # PQ codes are already compressed; SQ needs training data
+    qtype = STORAGE_TYPES[storage]
+    info = {"type": index_type, "dim": int(dim), "storage": storage}
+
+    if index_type == "flat":
+        if qtype is None:
+            return faiss.IndexFlatL2(dim), info
+        index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+        index.train(_train_sample(vectors, 65536))
+        return index, info
+
+    if index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, HNSW_M)
+            index.train(_train_sample(vectors, 65536))
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        info.update({"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION, "ef_search": HNSW_EF_SEARCH})
+        return index, info
+
+    nlist = _nlist_for(n)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat" and qtype is None:
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    elif index_type == "ivf_flat":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, faiss.METRIC_L2)
+    else:
+        pq_m = _pq_m_for(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, PQ_NBITS)
+        info.update({"pq_m": pq_m, "pq_nbits": PQ_NBITS})
+
+    index.train(_train_sample(vectors, nlist * _TRAIN_POINTS_PER_CENTROID))
+    info.update({"nlist": nlist, "nprobe": min(IVF_NPROBE, nlist)})
+    return index, info
+
+
+def search_params(info: dict, k: int, sel=None):
+    """
+    SearchParameters for one query against an index described by `info`.
+    Passing them per call (instead of setting index.nprobe/efSearch) keeps
+    shared cached indexes safe to search from several threads.
+    Returns None when no parameters are needed.
+    """
+    index_type = (info or {}).get("type", "flat")
+    kwargs = {} if sel is None else {"sel": sel}
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=int(info.get("nprobe", IVF_NPROBE)), **kwargs)
+    if index_type == "hnsw":
+        ef = max(int(info.get("ef_search", HNSW_EF_SEARCH)), k)
+        return faiss.SearchParametersHNSW(efSearch=ef, **kwargs)
+    if kwargs:
+        return faiss.SearchParameters(**kwargs)
+    return None
+
+
+def read_index(path, mmap: bool = None):
+    """
+    Opens an index for searching. With mmap, flat/HNSW/SQ storage is mapped
+    read-only from the file instead of copied into process memory; IVF
+    inverted lists are still read normally. Falls back to a plain read on
+    FAISS builds without IO_FLAG_MMAP_IFC.
+    """
+    mmap = INDEX_MMAP if mmap is None else mmap
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if mmap and flag:
+        return faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY)
+    return faiss.read_index(str(path))
+
+
+def measure_storage_tradeoff(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+                             index_type: str = "flat") -> list:
+    """
+    Recall@k against exact float32 search, search latency and index size
+    for each VECTOR_STORAGE option, e.g. on vectors read back from an
+    ingested index and a sample of its chunks as queries.
+    """
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for storage in STORAGE_TYPES:
+        index, info = build_index(vectors, index_type=index_type, storage=storage)
+        index.add(vectors)
+        params = search_params(info, k)
+
+        t0 = time.perf_counter()
+        _, found = index.search(queries, k, params=params)
+        dt = time.perf_counter() - t0
+
+        hits = sum(len(np.intersect1d(a, b)) for a, b in zip(truth, found))
+        results.append({
+            "storage": storage,
+            "type": info["type"],
+            "recall_at_k": hits / truth.size,
+            "ms_per_query": 1000 * dt / len(queries),
+            "bytes": int(faiss.serialize_index(index).nbytes),
+        })
+    return results
@@ -0,0 +1,126 @@
+# helper_lib/lexical.py
+
+"""
+Compact BM25 inverted index over chunk text.
+
+The index is a handful of flat NumPy arrays (CSR-style postings), so it
+holds no per-term Python objects and loads with a single np.load:
+- vocab     sorted term strings (looked up with searchsorted)
+- term_ptr  postings for term t live in [term_ptr[t], term_ptr[t+1])
+- doc_ids   chunk row numbers, grouped by term
+- tf        term frequency of that term in that chunk
+- doc_len   tokens per chunk
+"""
+
+import re
+from pathlib import Path
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+_MAX_TERM_LEN = 32
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were which will with".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [
+        t for t in _TOKEN_RE.findall(text.lower())
+        if t not in _STOPWORDS and len(t) <= _MAX_TERM_LEN
+    ]
+
+
+def build_bm25(texts: list) -> dict:
+    """Builds the postings arrays for a list of chunk texts."""
+    doc_tokens = [tokenize(t) for t in texts]
+    doc_len = np.array([len(toks) for toks in doc_tokens], dtype="int32")
+    n_docs = len(texts)
+
+    flat = [tok for toks in doc_tokens for tok in toks]
+    if not flat:
+        return {
+            "vocab": np.array([], dtype="U1"),
+            "term_ptr": np.zeros(1, dtype="int64"),
+            "doc_ids": np.zeros(0, dtype="int32"),
+            "tf": np.zeros(0, dtype="float32"),
+            "doc_len": doc_len,
+        }
+
+    vocab, term_ids = np.unique(np.array(flat), return_inverse=True)
+    doc_of_token = np.repeat(np.arange(n_docs, dtype="int64"), doc_len)
+
+    # One key per (term, doc) pair; unique() sorts by term, then doc.
+    keys, tf = np.unique(term_ids.astype("int64") * n_docs + doc_of_token, return_counts=True)
+    posting_terms = keys // n_docs
+    term_ptr = np.zeros(len(vocab) + 1, dtype="int64")
+    term_ptr[1:] = np.cumsum(np.bincount(posting_terms, minlength=len(vocab)))
+
+    return {
+        "vocab": vocab,
+        "term_ptr": term_ptr,
+        "doc_ids": (keys % n_docs).astype("int32"),
+        "tf": tf.astype("float32"),
+        "doc_len": doc_len,
+    }
+
+
+def save_bm25(bm25: dict, path: Path):
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp, **bm25)
+    tmp.replace(path)
+
+
+def load_bm25(path: Path) -> dict:
+    with np.load(path) as z:
+        return {name: z[name] for name in z.files}
+
+
+def bm25_nbytes(bm25: dict) -> int:
+    return int(sum(a.nbytes for a in bm25.values()))
+
+
+def bm25_scores(bm25: dict, query: str) -> np.ndarray:
+    """BM25 score of every chunk for `query` (zeros where no term matches)."""
+    doc_len = bm25["doc_len"]
+    scores = np.zeros(len(doc_len), dtype="float32")
+    vocab = bm25["vocab"]
+    if len(vocab) == 0 or len(doc_len) == 0:
+        return scores
+
+    terms = np.array(tokenize(query) or [""])
+    pos = np.minimum(np.searchsorted(vocab, terms), len(vocab) - 1)
+    term_ids = np.unique(pos[vocab[pos] == terms])
+
+    n_docs = len(doc_len)
+    avgdl = max(float(doc_len.mean()), 1.0)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avgdl)
+
+    for t in term_ids:
+        lo, hi = bm25["term_ptr"][t], bm25["term_ptr"][t + 1]
+        docs, tf = bm25["doc_ids"][lo:hi], bm25["tf"][lo:hi]
+        df = hi - lo
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+    return scores
+
+
+def bm25_top_k(bm25: dict, query: str, k: int, allowed: np.ndarray = None):
+    """
+    Returns (rows, scores) of the k best-scoring chunks with score > 0,
+    restricted to `allowed` rows when given.
+    """
+    scores = bm25_scores(bm25, query)
+    if allowed is not None:
+        keep = np.zeros(len(scores), dtype=bool)
+        keep[allowed] = True
+        scores[~keep] = 0
+    hits = np.flatnonzero(scores > 0)
+    if len(hits) > k:
+        hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+    hits = hits[np.argsort(-scores[hits], kind="stable")]
+    return hits, scores[hits]
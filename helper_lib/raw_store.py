@@ -0,0 +1,167 @@
+# helper_lib/raw_store.py
+
+"""
+Compressed store for downloaded filing documents.
+
+Layout: RAW_DIR/{cik}/{accession without dashes}/{document}.zst (or .gz)
+
+Keying by cik/accession/document instead of RAW_DIR/{acc}.html lets one
+accession keep several documents (primary doc, exhibits) side by side.
+Documents are compressed with zstd when the `zstandard` package is
+installed and gzip otherwise (RAW_COMPRESSION=zstd|gzip|none to force
+one). Filing HTML is mostly markup and compresses 8-15x.
+
+`open_text` decompresses as a stream, so the HTML parser is fed block by
+block without the whole document ever being held in memory as a string.
+`migrate_raw_dir` converts the old flat {acc}.html files.
+"""
+
+import gzip
+import io
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from .utils import RAW_DIR, CHUNK_DIR, normalize_cik
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - gzip fallback
+    zstandard = None
+
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION", "zstd" if zstandard else "gzip").lower()
+ZSTD_LEVEL = int(os.getenv("RAW_ZSTD_LEVEL", "10"))
+GZIP_LEVEL = 6
+
+_SUFFIX = {"zstd": ".zst", "gzip": ".gz", "none": ""}
+
+
+def _doc_dir(cik: str, accession: str) -> Path:
+    return RAW_DIR / normalize_cik(cik) / accession.replace("-", "")
+
+
+def find_raw(cik: str, accession: str, document: str):
+    """Path of a stored document in any supported format, or None."""
+    base = _doc_dir(cik, accession) / document
+    for suffix in (".zst", ".gz", ""):
+        p = base.with_name(base.name + suffix)
+        if p.exists():
+            return p
+    # Not migrated yet (see migrate_raw_dir)
+    legacy = RAW_DIR / f"{accession.replace('-', '')}.html"
+    return legacy if legacy.exists() else None
+
+
+def write_raw(cik: str, accession: str, document: str, text: str) -> Path:
+    """Compresses and stores a document atomically; returns its path."""
+    method = RAW_COMPRESSION
+    if method == "zstd" and zstandard is None:
+        method = "gzip"
+    data = text.encode("utf-8", errors="ignore")
+    if method == "zstd":
+        data = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    elif method == "gzip":
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+    d = _doc_dir(cik, accession)
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / (document + _SUFFIX[method])
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+    return path
+
+
+def open_text(path):
+    """Text stream over a stored document, decompressing on the fly."""
+    path = Path(path)
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed; pip install zstandard")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(raw, encoding="utf-8", errors="ignore")
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="ignore")
+    return open(path, "r", encoding="utf-8", errors="ignore")
+
+
+def read_text(path) -> str:
+    with open_text(path) as f:
+        return f.read()
+
+
+def iter_raw():
+    """All stored documents (new layout first, then legacy flat files)."""
+    yield from sorted(p for p in RAW_DIR.glob("*/*/*") if not p.name.endswith(".part"))
+    yield from sorted(RAW_DIR.glob("*.htm*"))
+
+
+# --- Migration ---
+
+def _known_documents() -> dict:
+    """accession (no dashes) -> (cik, primary_doc) from the catalog and chunk files."""
+    known = {}
+    frames = []
+    try:
+        from .catalog import list_catalog
+        frames.append(list_catalog()[["cik", "accession", "primary_doc"]])
+    except Exception:
+        pass
+    for p in CHUNK_DIR.glob("chunks_*.parquet"):
+        try:
+            frames.append(pd.read_parquet(p, columns=["cik", "accession", "primary_doc"]))
+        except Exception:
+            continue
+    for df in frames:
+        for cik, acc, doc in df.drop_duplicates("accession").itertuples(index=False):
+            known.setdefault(str(acc).replace("-", ""), (str(cik), str(doc)))
+    return known
+
+
+def migrate_raw_dir(remove_old: bool = True) -> dict:
+    """
+    Moves legacy RAW_DIR/{acc}.html files into the compressed store and
+    reports disk and read-time savings. Files whose cik/document cannot be
+    found in the catalog or chunk files are left in place.
+    """
+    known = _known_documents()
+    report = {"migrated": 0, "skipped": [], "bytes_before": 0, "bytes_after": 0,
+              "read_s_before": 0.0, "read_s_after": 0.0}
+
+    for old in sorted(RAW_DIR.glob("*.html")):
+        acc = old.stem
+        if acc not in known:
+            report["skipped"].append(old.name)
+            continue
+        cik, doc = known[acc]
+
+        t0 = time.perf_counter()
+        text = old.read_text(encoding="utf-8", errors="ignore")
+        t1 = time.perf_counter()
+        new = write_raw(cik, acc, doc, text)
+        t2 = time.perf_counter()
+        read_text(new)
+        t3 = time.perf_counter()
+
+        report["migrated"] += 1
+        report["bytes_before"] += old.stat().st_size
+        report["bytes_after"] += new.stat().st_size
+        report["read_s_before"] += t1 - t0
+        report["read_s_after"] += t3 - t2
+        if remove_old:
+            old.unlink()
+
+    before, after = report["bytes_before"], report["bytes_after"]
+    if after:
+        report["ratio"] = round(before / after, 1)
+    print(f"📦 Migrated {report['migrated']} filings to {RAW_COMPRESSION}: "
+          f"{before / 1e6:.1f} MB -> {after / 1e6:.1f} MB, read "
+          f"{report['read_s_before']:.2f}s -> {report['read_s_after']:.2f}s "
+          f"({len(report['skipped'])} unknown files left in place)")
+    return report
+
+
+if __name__ == "__main__":
+    migrate_raw_dir()
@@ -1,92 +1,1011 @@
 # helper_lib/retriever.py
 
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 import faiss
 import numpy as np
 import pandas as pd
-from openai import OpenAI
+import pyarrow as pa
+from . import embed_cache
+from .embedder import get_embedder
+from .lexical import build_bm25, save_bm25, load_bm25, bm25_nbytes, bm25_top_k
+from .filters import (
+    allowed_rows,
+    build_filter_index,
+    filter_index_nbytes,
+    load_filter_index,
+    save_filter_index,
+)
+from .index_types import INDEX_MMAP, build_index, read_index, search_params
 from .utils import INDEX_DIR, normalize_cik
 
-client = OpenAI()
+# Memory budget for the in-process index cache (MB). 0 disables caching.
+INDEX_CACHE_MAX_MB = float(os.getenv("INDEX_CACHE_MAX_MB", "2048"))
+
+# Maintain one multi-company index per form next to the per-CIK files.
+GLOBAL_INDEX = os.getenv("GLOBAL_INDEX", "0") == "1"
+
+# Query embedding LRU (entries / seconds; TTL 0 means entries never expire)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "0"))
+
+# "vector" (dense only) or "hybrid" (dense + BM25, reciprocal-rank fused)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))  # × k per retriever
+RRF_K = 60
 
 # -----------------------------
 # Embeddings
 # -----------------------------
 def embed_texts(texts: list) -> np.ndarray:
+    """Embeds texts with the configured backend (see helper_lib.embedder)."""
+    return get_embedder().embed(texts)
+
+
+def embed_texts_cached(texts: list) -> np.ndarray:
+    """
+    embed_texts() backed by the on-disk embedding cache: only texts never
+    embedded before with the active backend are sent to it.
+    """
     if not texts:
-        return np.zeros((0, 1536), dtype="float32")
-    resp = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=texts
+        return embed_texts(texts)
+
+    model = get_embedder().name
+    vectors, found = embed_cache.get_many(model, texts)
+    missing = np.flatnonzero(~found)
+    print(f"💾 Embedding cache: {len(texts) - len(missing)}/{len(texts)} chunks reused")
+    if len(missing) == 0:
+        return vectors
+
+    missing_texts = [texts[i] for i in missing]
+    new_vectors = embed_texts(missing_texts)
+    embed_cache.put_many(model, missing_texts, new_vectors)
+
+    if vectors is None:
+        vectors = np.empty((len(texts), new_vectors.shape[1]), dtype="float32")
+    vectors[missing] = new_vectors
+    return vectors
+
+# -----------------------------
+# Query Embedding Cache
+# -----------------------------
+# (backend name, query text) -> (vector, inserted_at); most recently used at the end.
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _query_cache_get(query: str):
+    key = (get_embedder().name, query)
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is None:
+            return None
+        vec, ts = entry
+        if QUERY_CACHE_TTL > 0 and time.monotonic() - ts > QUERY_CACHE_TTL:
+            del _query_cache[key]
+            return None
+        _query_cache.move_to_end(key)
+        return vec
+
+
+def _query_cache_put(query: str, vec: np.ndarray):
+    if QUERY_CACHE_SIZE <= 0:
+        return
+    key = (get_embedder().name, query)
+    with _query_cache_lock:
+        _query_cache[key] = (vec, time.monotonic())
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+
+
+def embed_queries(queries: list) -> np.ndarray:
+    """
+    Embeds search queries, serving repeats from the in-memory LRU and
+    sending all misses in a single embeddings call.
+    """
+    cached = [_query_cache_get(q) for q in queries]
+    missing = list(dict.fromkeys(q for q, v in zip(queries, cached) if v is None))
+
+    if missing:
+        new_vectors = dict(zip(missing, embed_texts(missing)))
+        for q, vec in new_vectors.items():
+            _query_cache_put(q, vec.copy())
+        cached = [new_vectors[q] if v is None else v for q, v in zip(queries, cached)]
+
+    if not queries:
+        return embed_texts([])
+    return np.stack(cached).astype("float32", copy=False)
+
+# -----------------------------
+# Index / Metadata Cache
+# -----------------------------
+# key -> {"sig": ..., "value": ..., "nbytes": ...}
+# Keys are (kind, cik, form); cik is None for the global per-form index.
+# Ordered oldest → most recently used so eviction pops from the front.
+_index_cache = OrderedDict()
+_index_cache_bytes = 0
+_index_cache_lock = threading.Lock()
+
+
+def _index_paths(cik: str, form: str):
+    return (
+        INDEX_DIR / f"{cik}_{form}.index",
+        INDEX_DIR / f"{cik}_{form}_meta.parquet",
+    )
+
+
+def _meta_arrow_path(cik: str, form: str) -> Path:
+    return INDEX_DIR / f"{cik}_{form}_meta.arrow"
+
+
+def _filters_path(cik: str, form: str) -> Path:
+    return INDEX_DIR / f"{cik}_{form}_filters.npz"
+
+
+def _bm25_path(cik: str, form: str) -> Path:
+    return INDEX_DIR / f"{cik}_{form}_bm25.npz"
+
+
+def _info_path(prefix: str, form: str) -> Path:
+    """Sidecar JSON with the index type and its search parameters."""
+    return INDEX_DIR / f"{prefix}_{form}_index.json"
+
+
+def _file_signature(*paths: Path) -> tuple:
+    """(mtime_ns, size) per file; changes whenever a re-ingest rewrites it."""
+    sig = []
+    for p in paths:
+        st = p.stat()
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def _mapped_code_bytes(index) -> int:
+    """
+    Bytes of `index` that INDEX_MMAP actually maps: IO_FLAG_MMAP_IFC only
+    covers flat code storage (IndexFlat / IndexScalarQuantizer, and the
+    storage under an HNSW graph). IVF inverted lists, IVF-PQ codes, HNSW
+    graphs and id maps are still read into this worker's memory.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return _mapped_code_bytes(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return _mapped_code_bytes(index.storage)
+    if isinstance(index, faiss.IndexFlatCodes):
+        return int(index.ntotal) * int(index.code_size)
+    return 0
+
+
+def _index_nbytes(index, path: Path) -> int:
+    # Serialized size tracks in-memory size for flat, HNSW and IVF(PQ) alike.
+    # Memory-mapped codes live in the shared page cache, not this worker, so
+    # only the rest (graph, inverted lists, ids) counts against the budget.
+    size = int(path.stat().st_size)
+    if not INDEX_MMAP or not getattr(faiss, "IO_FLAG_MMAP_IFC", 0):
+        return size
+    return max(4096, size - _mapped_code_bytes(index))
+
+
+def _frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _evict_locked(budget: int):
+    global _index_cache_bytes
+    while _index_cache and _index_cache_bytes > budget:
+        _, entry = _index_cache.popitem(last=False)
+        _index_cache_bytes -= entry["nbytes"]
+
+
+def _cached_load(key: tuple, paths: tuple, loader):
+    """
+    Returns loader()'s value for `key`, reusing the cached copy while the
+    files in `paths` are unchanged. `loader` returns (value, nbytes).
+    """
+    global _index_cache_bytes
+    sig = _file_signature(*paths)
+
+    with _index_cache_lock:
+        entry = _index_cache.get(key)
+        if entry is not None and entry["sig"] == sig:
+            _index_cache.move_to_end(key)
+            return entry["value"]
+
+    # Load outside the lock so other companies stay servable meanwhile.
+    value, nbytes = loader()
+
+    budget = int(INDEX_CACHE_MAX_MB * 1024 * 1024)
+    if nbytes > budget:
+        return value
+
+    with _index_cache_lock:
+        old = _index_cache.pop(key, None)
+        if old is not None:
+            _index_cache_bytes -= old["nbytes"]
+        _index_cache[key] = {"sig": sig, "value": value, "nbytes": nbytes}
+        _index_cache_bytes += nbytes
+        _evict_locked(budget)
+
+    return value
+
+
+def invalidate_index_cache(cik: str = None, form: str = None):
+    """
+    Drop cached entries for a (cik, form), for every company of a form
+    (cik=None), or everything when called with no args.
+    """
+    global _index_cache_bytes
+    cik = normalize_cik(cik) if cik is not None else None
+    with _index_cache_lock:
+        for key in list(_index_cache):
+            _, k_cik, k_form = key
+            if cik is not None and k_cik != cik:
+                continue
+            if form is not None and k_form != form:
+                continue
+            _index_cache_bytes -= _index_cache.pop(key)["nbytes"]
+
+
+def index_cache_stats() -> dict:
+    with _index_cache_lock:
+        return {
+            "entries": len(_index_cache),
+            "bytes": _index_cache_bytes,
+            "budget_bytes": int(INDEX_CACHE_MAX_MB * 1024 * 1024),
+        }
+
+
+def load_meta(cik: str, form: str):
+    """Returns the chunk metadata frame for a company, or None."""
+    cik = normalize_cik(cik)
+    _, meta_path = _index_paths(cik, form)
+    if not meta_path.exists():
+        return None
+
+    def loader():
+        df = pd.read_parquet(meta_path)
+        return df, _frame_nbytes(df)
+
+    return _cached_load(("meta", cik, form), (meta_path,), loader)
+
+
+def _write_meta_arrow(meta_df: pd.DataFrame, path: Path):
+    """Uncompressed Arrow IPC file, so readers can memory-map it zero-copy."""
+    table = pa.Table.from_pandas(meta_df.reset_index(drop=True), preserve_index=False)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _load_meta_table(cik: str, form: str):
+    path = _meta_arrow_path(cik, form)
+    if not path.exists():
+        return None
+
+    def loader():
+        # Buffers point into the mapping; only pages of rows actually
+        # taken are ever read from disk.
+        table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+        return table, 4096
+
+    return _cached_load(("meta_arrow", cik, form), (path,), loader)
+
+
+def fetch_meta_rows(cik: str, form: str, rows) -> pd.DataFrame:
+    """
+    Metadata for just the given chunk rows (index = row numbers), so cost
+    depends on k rather than on filing size. Falls back to the parquet
+    file for companies ingested before the Arrow copy existed.
+    """
+    cik = normalize_cik(cik)
+    rows = np.asarray(rows, dtype="int64")
+    table = _load_meta_table(cik, form)
+    if table is None:
+        meta_df = load_meta(cik, form)
+        if meta_df is None:
+            return pd.DataFrame()
+        return meta_df.iloc[rows].copy()
+
+    df = table.take(pa.array(rows)).to_pandas()
+    df.index = rows
+    return df
+
+
+def load_faiss_index(cik: str, form: str):
+    """
+    Returns the company's FAISS index, or None if it has not been ingested.
+    Loaded indexes are kept in a process-wide LRU and are reloaded
+    automatically when the files on disk change.
+    """
+    cik = normalize_cik(cik)
+    idx_path, meta_path = _index_paths(cik, form)
+
+    if not idx_path.exists() or not meta_path.exists():
+        invalidate_index_cache(cik, form)
+        return None
+
+    def loader():
+        index = read_index(idx_path)
+        return index, _index_nbytes(index, idx_path)
+
+    index = _cached_load(("index", cik, form), (idx_path,), loader)
+    _check_dim(index, f"CIK={cik} {form}")
+    return index
+
+
+def _check_dim(index, label: str):
+    embedder = get_embedder()
+    if index.d != embedder.dim:
+        raise ValueError(
+            f"Index for {label} has dim {index.d} but embedder '{embedder.name}' "
+            f"produces {embedder.dim}; re-ingest with full_refresh=True."
+        )
+
+
+def load_index(cik: str, form: str):
+    """
+    Returns (faiss_index, meta_df) for a company, or (None, None) if it has
+    not been ingested. Query paths use load_faiss_index() and
+    fetch_meta_rows() instead, which never load the full metadata.
+    """
+    index = load_faiss_index(cik, form)
+    if index is None:
+        return None, None
+    return index, load_meta(cik, form)
+
+
+def load_lexical_index(cik: str, form: str):
+    """Returns the company's BM25 postings arrays, or None if not built."""
+    cik = normalize_cik(cik)
+    path = _bm25_path(cik, form)
+    if not path.exists():
+        return None
+
+    def loader():
+        bm25 = load_bm25(path)
+        return bm25, bm25_nbytes(bm25)
+
+    return _cached_load(("bm25", cik, form), (path,), loader)
+
+
+def load_filter_arrays(cik: str, form: str):
+    """Sorted per-column row arrays used to build search-time id selectors."""
+    cik = normalize_cik(cik)
+    path = _filters_path(cik, form)
+    if not path.exists():
+        return None
+
+    def loader():
+        fidx = load_filter_index(path)
+        return fidx, filter_index_nbytes(fidx)
+
+    return _cached_load(("filters", cik, form), (path,), loader)
+
+
+def _filtered_rows(cik: str, form: str, filters: dict):
+    """
+    Rows allowed by `filters` for one company (None = unrestricted).
+    Companies ingested before filter arrays existed are built on the fly
+    from their metadata once.
+    """
+    if not filters:
+        return None
+    fidx = load_filter_arrays(cik, form)
+    if fidx is None:
+        meta_df = load_meta(cik, form)
+        if meta_df is None:
+            return None
+        fidx = build_filter_index(meta_df)
+        save_filter_index(fidx, _filters_path(normalize_cik(cik), form))
+    return allowed_rows(fidx, filters)
+
+
+def _load_info(key: tuple, path: Path) -> dict:
+    # Indexes written before index types were configurable are flat.
+    if not path.exists():
+        return {"type": "flat"}
+
+    def loader():
+        return json.loads(path.read_text()), 256
+
+    return _cached_load(key, (path,), loader)
+
+
+def load_index_info(cik: str, form: str) -> dict:
+    """Index type and search parameters recorded at ingest time."""
+    cik = normalize_cik(cik)
+    return _load_info(("info", cik, form), _info_path(cik, form))
+
+
+def _write_index_info(info: dict, path: Path):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(info, indent=2))
+    os.replace(tmp, path)
+
+
+def _index_vectors(index) -> np.ndarray:
+    """
+    Reads the stored vectors back out of an index. IVF indexes need a
+    direct map first; PQ and SQ storage return the (lossy) decoded vectors.
+    """
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        faiss.extract_index_ivf(index).make_direct_map()
+        return index.reconstruct_n(0, index.ntotal)
+
+# -----------------------------
+# Global (Multi-Company) Index
+# -----------------------------
+# One index per form holding every ingested company (IVF indexes store the
+# ids themselves, flat ones sit in an IndexIDMap2). FAISS ids pack
+# the CIK and the row inside that company's meta parquet:
+#     id = (int(cik) << _ROW_BITS) | row
+# so each company occupies one contiguous id range and hits map straight
+# back to per-CIK metadata. A small id table (id, cik, accession) sits
+# next to the index. The global info sidecar records the per-CIK index
+# version each company's vectors came from; a company whose own index has
+# moved on since is searched through its per-CIK index instead.
+_ROW_BITS = 24
+_ROW_MASK = (1 << _ROW_BITS) - 1
+_global_write_lock = threading.Lock()
+
+
+def _global_paths(form: str):
+    return (
+        INDEX_DIR / f"global_{form}.index",
+        INDEX_DIR / f"global_{form}_ids.parquet",
     )
-    vectors = [d.embedding for d in resp.data]
-    return np.array(vectors).astype("float32")
+
+
+def _cik_int(cik: str):
+    cik = normalize_cik(cik)
+    return int(cik) if cik.isdigit() else None
+
+
+def _encode_ids(cik_int: int, n: int) -> np.ndarray:
+    if n > _ROW_MASK:
+        raise ValueError(f"Too many chunks for one company in global index: {n}")
+    return (np.int64(cik_int) << _ROW_BITS) | np.arange(n, dtype="int64")
+
+
+def _cik_range_selector(cik_int: int):
+    lo = int(cik_int) << _ROW_BITS
+    return faiss.IDSelectorRange(lo, lo + _ROW_MASK + 1)
+
+
+def _any_selector(selectors: list):
+    """
+    OR of several selectors as a balanced tree. Returns (selector, keep):
+    FAISS holds raw pointers to the children, so `keep` must stay alive
+    until the search / removal using the selector has returned.
+    """
+    keep = list(selectors)
+    level = list(selectors)
+    while len(level) > 1:
+        nxt = [faiss.IDSelectorOr(a, b) for a, b in zip(level[::2], level[1::2])]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        keep.extend(nxt)
+        level = nxt
+    return level[0], keep
+
+
+def _with_ids(inner):
+    """
+    `inner` able to take the packed global ids. IVF indexes store ids in
+    their inverted lists, so add_with_ids / remove_ids go to them directly.
+    IndexIDMap2 keeps ids by position, which only stays right for flat
+    storage: IndexIVF.remove_ids leaves the remaining entries' labels as
+    they were, so after a removal the id map points at other rows.
+    """
+    if faiss.try_extract_index_ivf(inner) is not None:
+        return inner
+    return faiss.IndexIDMap2(inner)
+
+
+def _is_stale_id_map(index) -> bool:
+    """An IndexIDMap over an IVF index, as written before _with_ids existed."""
+    index = faiss.downcast_index(index)
+    return isinstance(index, faiss.IndexIDMap) and faiss.try_extract_index_ivf(index.index) is not None
+
+
+def _write_atomic_index(index, path: Path):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, path)
+
+
+def _write_atomic_parquet(df: pd.DataFrame, path: Path):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _id_table(chunks_df: pd.DataFrame, cik_i: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "id": _encode_ids(cik_i, len(chunks_df)),
+        "cik": np.full(len(chunks_df), cik_i, dtype="int64"),
+        "accession": chunks_df["accession"].astype(str).to_numpy(),
+    })
+
+
+def _finalize_id_table(ids_df: pd.DataFrame) -> pd.DataFrame:
+    ids_df = ids_df.reset_index(drop=True)
+    ids_df["id"] = ids_df["id"].astype("int64")
+    ids_df["cik"] = ids_df["cik"].astype("int64")
+    ids_df["accession"] = ids_df["accession"].astype("category")
+    return ids_df
+
+
+def update_global_index(chunks_df: pd.DataFrame, embeddings: np.ndarray, cik: str, form: str,
+                        version: int = None):
+    """Replace one company's vectors in the global index for `form`."""
+    update_global_index_many([(cik, chunks_df, embeddings, version)], form)
+
+
+def update_global_index_many(updates: list, form: str):
+    """
+    Replaces several companies' vectors in the global index for `form` with
+    one read and one write of the index. `updates` holds
+    (cik, meta_df, embeddings, version) tuples, or bare CIKs whose current
+    metadata is loaded here and whose vectors come from the embedding cache.
+    A brand-new global index starts with a type sized for the first
+    company; run rebuild_global_index() to retrain once it has grown.
+    """
+    resolved = {}
+    for u in updates:
+        cik, meta_df, embeddings, version = u if isinstance(u, tuple) else (u, None, None, None)
+        cik = normalize_cik(cik)
+        if _cik_int(cik) is None:
+            continue
+        if meta_df is None:
+            meta_df = load_meta(cik, form)
+            if meta_df is None:
+                continue
+            version = load_index_info(cik, form).get("version")
+        resolved[cik] = (meta_df, embeddings, version)  # last update of a company wins
+    if not resolved:
+        return
+
+    idx_path, ids_path = _global_paths(form)
+    info_path = _info_path("global", form)
+
+    def vectors_for(meta_df, embeddings):
+        if embeddings is not None:
+            return embeddings
+        texts = meta_df["text"].tolist() if not meta_df.empty else []
+        return embed_texts_cached(texts) if texts else np.zeros((0, get_embedder().dim), dtype="float32")
+
+    with _global_write_lock:
+        cik_ints = [_cik_int(c) for c in resolved]
+        index = faiss.read_index(str(idx_path)) if idx_path.exists() and ids_path.exists() else None
+        info = json.loads(info_path.read_text()) if info_path.exists() else {"type": "flat"}
+        if index is not None and _is_stale_id_map(index):
+            # Its ids may already point at other rows: start over from the
+            # per-CIK indexes, which already hold these updates
+            print(f"⚠️ Global {form} index keeps IVF ids in an IndexIDMap2; rebuilding it")
+            built = _build_global_index(form, index_type=info.get("type"))
+            index, ids_df, info = built[:3] if built is not None else (None, None, None)
+        elif index is not None:
+            ids_df = pd.read_parquet(ids_path)
+            if "versions" not in info:
+                # Index written before versions were tracked: adopt the current ones
+                info["versions"] = {
+                    str(c).zfill(10): load_index_info(str(c).zfill(10), form).get("version")
+                    for c in ids_df["cik"].unique().tolist()
+                }
+        if index is not None:
+            sel, keep = _any_selector([_cik_range_selector(c) for c in cik_ints])
+            index.remove_ids(sel)
+            ids_df = ids_df[~ids_df["cik"].isin(cik_ints)]
+        else:
+            first_meta, first_emb, _ = next(iter(resolved.values()))
+            first = vectors_for(first_meta, first_emb)
+            inner, info = build_index(first, removable=True)
+            index = _with_ids(inner)
+            ids_df = pd.DataFrame({"id": [], "cik": [], "accession": []})
+
+        versions = info.setdefault("versions", {})
+        id_tables = [ids_df]
+        for cik, (meta_df, embeddings, version) in resolved.items():
+            new_ids = _id_table(meta_df, _cik_int(cik))
+            if len(new_ids):
+                index.add_with_ids(vectors_for(meta_df, embeddings), new_ids["id"].to_numpy())
+            id_tables.append(new_ids)
+            if version is not None:
+                versions[cik] = int(version)
+            else:
+                versions.pop(cik, None)
+
+        ids_df = _finalize_id_table(pd.concat(id_tables, ignore_index=True))
+
+        _write_atomic_index(index, idx_path)
+        _write_atomic_parquet(ids_df, ids_path)
+        # Versions last: a crash before this leaves the changed companies on
+        # their per-CIK indexes rather than pointing at mismatched rows
+        _write_index_info(info, info_path)
+    print(f"🌐 Global {form} index updated for {len(resolved)} companies")
+
+
+def rebuild_global_index(form: str = "10-K", index_type: str = None) -> int:
+    """
+    Builds the global index for `form` from the existing per-CIK files,
+    e.g. when turning GLOBAL_INDEX on for a deployment that already has
+    data, or to retrain it for its current size. Returns the number of
+    companies added.
+    """
+    built = _build_global_index(form, index_type)
+    if built is None:
+        return 0
+    index, ids_df, info, n_companies = built
+
+    idx_path, ids_path = _global_paths(form)
+    with _global_write_lock:
+        _write_atomic_index(index, idx_path)
+        _write_atomic_parquet(ids_df, ids_path)
+        _write_index_info(info, _info_path("global", form))
+    return n_companies
+
+
+def _build_global_index(form: str, index_type: str = None):
+    """(index, ids_df, info, n_companies) from the per-CIK files, or None if there are none."""
+    vectors, id_tables, versions = [], [], {}
+    for path in sorted(INDEX_DIR.glob(f"*_{form}.index")):
+        cik = path.name[: -len(f"_{form}.index")]
+        if not cik.isdigit():
+            continue
+        index, meta_df = load_index(cik, form)
+        if index is None or index.ntotal == 0:
+            continue
+        vectors.append(_index_vectors(index))
+        id_tables.append(_id_table(meta_df, int(cik)))
+        version = load_index_info(cik, form).get("version")
+        if version is not None:
+            versions[cik] = int(version)
+
+    if not vectors:
+        return None
+
+    all_vectors = np.vstack(vectors)
+    ids_df = _finalize_id_table(pd.concat(id_tables, ignore_index=True))
+
+    inner, info = build_index(all_vectors, index_type=index_type, removable=True)
+    index = _with_ids(inner)
+    index.add_with_ids(all_vectors, ids_df["id"].to_numpy())
+    info["versions"] = versions
+    return index, ids_df, info, len(id_tables)
+
+
+def load_global_index(form: str):
+    """Returns (faiss_index, ids_df) for the global index, or (None, None)."""
+    idx_path, ids_path = _global_paths(form)
+    if not idx_path.exists() or not ids_path.exists():
+        return None, None
+
+    def index_loader():
+        index = read_index(idx_path)
+        return index, _index_nbytes(index, idx_path)
+
+    def ids_loader():
+        df = pd.read_parquet(ids_path)
+        return df, _frame_nbytes(df)
+
+    index = _cached_load(("global_index", None, form), (idx_path,), index_loader)
+    if _is_stale_id_map(index):
+        # Written before _with_ids: hits may map to other companies' rows.
+        # Fall back to per-CIK search until the next update rebuilds it.
+        return None, None
+    _check_dim(index, f"global {form}")
+    ids_df = _cached_load(("global_ids", None, form), (ids_path,), ids_loader)
+    return index, ids_df
+
+
+def _global_search(q_vec: np.ndarray, cik_ints: list, form: str, k: int,
+                   filters: dict = None) -> pd.DataFrame:
+    index, ids_df = load_global_index(form)
+    if index is None or not cik_ints:
+        return pd.DataFrame()
+
+    # A company's rows are one contiguous id range; only filtered companies
+    # need an explicit id list, and only of their allowed rows
+    selectors = []
+    for cik_i in cik_ints:
+        rows = _filtered_rows(str(cik_i), form, filters) if filters else None
+        if rows is None:
+            selectors.append(_cik_range_selector(cik_i))
+        elif len(rows):
+            selectors.append(faiss.IDSelectorBatch((np.int64(cik_i) << _ROW_BITS) | rows))
+    if not selectors:
+        return pd.DataFrame()
+
+    info = _load_info(("info", None, form), _info_path("global", form))
+    sel, keep = _any_selector(selectors)
+    params = search_params(info, k, sel=sel)
+    D, I = index.search(q_vec, k, params=params)
+
+    valid = I[0] >= 0
+    hit_ids, dists = I[0][valid], D[0][valid]
+    hit_ciks = hit_ids >> _ROW_BITS
+    hit_rows = hit_ids & _ROW_MASK
+
+    frames = []
+    for cik_i in np.unique(hit_ciks):
+        mask = hit_ciks == cik_i
+        rows = fetch_meta_rows(str(int(cik_i)), form, hit_rows[mask])
+        if rows.empty:
+            continue
+        frames.append(rows.assign(distance=dists[mask]))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames)
 
 # -----------------------------
-# ORIGINAL FUNCTIONS (UNTOUCHED)
+# Index build / update
 # -----------------------------
-def build_index_for_chunks(chunks_df: pd.DataFrame, cik: str, form: str):
+def has_index(cik: str, form: str) -> bool:
+    idx_path, meta_path = _index_paths(normalize_cik(cik), form)
+    return idx_path.exists() and meta_path.exists()
+
+
+def _write_company_index(cik: str, form: str, index, info: dict, meta_df: pd.DataFrame,
+                         embeddings: np.ndarray = None, global_updates: list = None) -> dict:
+    """
+    Persists a company's index, metadata, BM25 postings and info sidecar,
+    bumping the index version. `embeddings` (all rows, in meta order) is
+    only needed for the global index and is recomputed from the embedding
+    cache when omitted. With a `global_updates` list the global index is
+    not touched; the CIK is queued there for one update_global_index_many
+    call at the end of a multi-company ingest.
+    """
+    info["ntotal"] = int(index.ntotal)
+    info["version"] = int(load_index_info(cik, form).get("version", 0)) + 1
+    texts = meta_df["text"].tolist() if not meta_df.empty else []
+
+    _write_index_info(info, _info_path(cik, form))
+    save_bm25(build_bm25(texts), _bm25_path(cik, form))
+    save_filter_index(build_filter_index(meta_df), _filters_path(cik, form))
+    # Replace atomically: other workers may still have the old files mapped or open.
+    _write_atomic_index(index, INDEX_DIR / f"{cik}_{form}.index")
+    _write_atomic_parquet(meta_df.reset_index(drop=True), INDEX_DIR / f"{cik}_{form}_meta.parquet")
+    _write_meta_arrow(meta_df, _meta_arrow_path(cik, form))
+    invalidate_index_cache(cik, form)
+
+    if GLOBAL_INDEX:
+        if global_updates is not None:
+            global_updates.append(cik)
+        else:
+            if embeddings is None:
+                embeddings = embed_texts_cached(texts)
+            update_global_index(meta_df, embeddings, cik, form, info["version"])
+    return info
+
+
+def build_index_for_chunks(chunks_df: pd.DataFrame, cik: str, form: str,
+                           global_updates: list = None) -> dict:
     cik = normalize_cik(cik)
     texts = chunks_df["text"].tolist()
-    embeddings = embed_texts(texts)
+    embeddings = embed_texts_cached(texts)
 
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
+    index, info = build_index(embeddings)
+    info["embedder"] = get_embedder().name
     index.add(embeddings)
+    print(f"🗂️ Built {info['type']} index for CIK={cik} {form} ({index.ntotal} vectors)")
 
-    faiss.write_index(index, str(INDEX_DIR / f"{cik}_{form}.index"))
-    chunks_df.to_parquet(INDEX_DIR / f"{cik}_{form}_meta.parquet")
+    return _write_company_index(cik, form, index, info, chunks_df, embeddings, global_updates)
 
-def search(query: str, cik: str, form: str, k: int = 5) -> pd.DataFrame:
+
+def update_index_for_chunks(new_chunks_df: pd.DataFrame, cik: str, form: str,
+                            drop_accessions=(), global_updates: list = None) -> dict:
+    """
+    Incremental counterpart of build_index_for_chunks(): appends the
+    vectors and metadata of new filings to the existing index and drops
+    superseded accessions. Appends reuse the trained index as-is; drops
+    rebuild it from the embedding cache (no embedding API calls).
+    Returns the new index info.
+    """
     cik = normalize_cik(cik)
+    index, meta_df = load_index(cik, form)
+    if index is None:
+        return build_index_for_chunks(new_chunks_df, cik, form, global_updates)
+
+    # An accession already in the index (written just before a crash that
+    # kept it out of the catalog) is not appended a second time
+    if not new_chunks_df.empty:
+        present = set(meta_df["accession"]) - set(drop_accessions)
+        dup = new_chunks_df["accession"].isin(present).to_numpy()
+        if dup.any():
+            print(f"♻️ CIK={cik} {form}: {int(dup.sum())} chunks of already indexed accessions skipped")
+            new_chunks_df = new_chunks_df[~dup]
+
+    drop = meta_df["accession"].isin(list(drop_accessions)).to_numpy()
+    new_texts = new_chunks_df["text"].tolist() if not new_chunks_df.empty else []
+    # Embed new chunks first so a rebuild below finds all of them cached.
+    new_vectors = embed_texts_cached(new_texts) if new_texts else None
+    merged = pd.concat([meta_df[~drop], new_chunks_df], ignore_index=True)
 
-    idx_path = INDEX_DIR / f"{cik}_{form}.index"
-    meta_path = INDEX_DIR / f"{cik}_{form}_meta.parquet"
+    if drop.any():
+        vectors = embed_texts_cached(merged["text"].tolist())
+        index, info = build_index(vectors)
+        info["embedder"] = get_embedder().name
+        index.add(vectors)
+        print(f"🗂️ Rebuilt {info['type']} index for CIK={cik} {form}: "
+              f"-{int(drop.sum())} / +{len(new_texts)} chunks")
+        return _write_company_index(cik, form, index, info, merged, vectors, global_updates)
 
-    if not idx_path.exists():
+    # Append to a private copy so the cached, shared index is never mutated.
+    index = faiss.read_index(str(_index_paths(cik, form)[0]))
+    if len(new_texts):
+        index.add(new_vectors)
+    info = dict(load_index_info(cik, form))
+    print(f"🗂️ Appended {len(new_texts)} chunks to {info.get('type', 'flat')} index for CIK={cik} {form}")
+    return _write_company_index(cik, form, index, info, merged, global_updates=global_updates)
+
+def _rrf_fuse(ranked: list, k: int) -> pd.DataFrame:
+    """
+    Reciprocal-rank fusion of several ranked hit lists (each a DataFrame in
+    rank order). Chunks are identified by (cik, chunk_id); the fused score
+    is stored in an "rrf" column, highest first.
+    """
+    frames = [
+        df.assign(rrf=1.0 / (RRF_K + np.arange(1, len(df) + 1)))
+        for df in ranked if not df.empty
+    ]
+    if not frames:
         return pd.DataFrame()
 
-    index = faiss.read_index(str(idx_path))
-    meta_df = pd.read_parquet(meta_path)
+    df = pd.concat(frames)
+    df["rrf"] = df.groupby(["cik", "chunk_id"])["rrf"].transform("sum")
+    df = df.drop_duplicates(["cik", "chunk_id"])
+    return df.sort_values("rrf", ascending=False, kind="stable").head(k)
+
+
+def _lexical_hits(query: str, cik: str, form: str, k: int, filters: dict = None) -> pd.DataFrame:
+    bm25 = load_lexical_index(cik, form)
+    if bm25 is None:
+        return pd.DataFrame()
+    rows, scores = bm25_top_k(bm25, query, k, allowed=_filtered_rows(cik, form, filters))
+    return fetch_meta_rows(cik, form, rows).assign(bm25=scores)
+
+
+def _company_search_params(cik: str, form: str, k: int, filters: dict = None):
+    """
+    (params, allowed) for one company's FAISS search; `allowed` is an
+    empty array when the filters exclude every chunk.
+    """
+    rows = _filtered_rows(cik, form, filters)
+    sel = None if rows is None else faiss.IDSelectorBatch(rows)
+    return search_params(load_index_info(cik, form), k, sel=sel), rows
+
+
+def search(query: str, cik: str, form: str, k: int = 5, mode: str = None,
+           filters: dict = None) -> pd.DataFrame:
+    """
+    Top-k chunks for one company. mode="hybrid" fuses dense results with
+    BM25 matches on exact terms (defaults to RETRIEVAL_MODE). `filters`
+    (see helper_lib.filters) restrict the search inside FAISS.
+    """
+    mode = mode or RETRIEVAL_MODE
+    index = load_faiss_index(cik, form)
+    if index is None:
+        return pd.DataFrame()
+
+    n = k * HYBRID_CANDIDATES if mode == "hybrid" else k
+    params, rows = _company_search_params(cik, form, n, filters)
+    if rows is not None and len(rows) == 0:
+        return pd.DataFrame()
+
+    q_vec = embed_queries([query])
+    D, I = index.search(q_vec, n, params=params)
+
+    valid = I[0] >= 0
+    if mode != "hybrid":
+        return fetch_meta_rows(cik, form, I[0][valid])
 
-    q_vec = embed_texts([query])
-    D, I = index.search(q_vec, k)
+    dense = fetch_meta_rows(cik, form, I[0][valid]).assign(distance=D[0][valid])
+    return _rrf_fuse([dense, _lexical_hits(query, cik, form, n, filters)], k)
 
-    valid_indices = I[0][I[0] >= 0]
-    return meta_df.iloc[valid_indices].copy()
+
+def search_many(queries: list, cik: str, form: str, k: int = 5, filters: dict = None) -> list:
+    """
+    Batch version of search(): embeds all queries in one call and runs one
+    matrix search. Returns one DataFrame (with a distance column) per query.
+    """
+    index = load_faiss_index(cik, form)
+    if index is None:
+        return [pd.DataFrame() for _ in queries]
+    if not queries:
+        return []
+
+    params, rows = _company_search_params(cik, form, k, filters)
+    if rows is not None and len(rows) == 0:
+        return [pd.DataFrame() for _ in queries]
+
+    q_vecs = embed_queries(queries)
+    D, I = index.search(q_vecs, k, params=params)
+
+    results = []
+    for dists, ids in zip(D, I):
+        valid = ids >= 0
+        results.append(fetch_meta_rows(cik, form, ids[valid]).assign(distance=dists[valid]))
+    return results
 
 
 # -----------------------------
 # NEW FUNCTION — Multi-Company Search
 # -----------------------------
-def multi_search(query: str, cik_list: list, form="10-K", k=5) -> pd.DataFrame:
-    """Search across multiple companies and merge results."""
-    q_vec = embed_texts([query])
-    results = []
+def _multi_vector_search(q_vec: np.ndarray, ciks: list, form: str, k: int,
+                        filters: dict = None) -> pd.DataFrame:
+    frames = []
 
-    for cik in cik_list:
-        cik_norm = normalize_cik(cik)
-        idx = INDEX_DIR / f"{cik_norm}_{form}.index"
-        meta = INDEX_DIR / f"{cik_norm}_{form}_meta.parquet"
+    if GLOBAL_INDEX:
+        _, ids_df = load_global_index(form)
+        if ids_df is not None:
+            covered = set(ids_df["cik"].unique().tolist())
+            versions = _load_info(("info", None, form), _info_path("global", form)).get("versions")
+            in_global = [
+                c for c in ciks
+                if c.isdigit() and int(c) in covered
+                # Skip companies re-indexed since the global index last saw them
+                and (versions is None or versions.get(c) == load_index_info(c, form).get("version"))
+            ]
+            frames.append(_global_search(q_vec, [int(c) for c in in_global], form, k, filters))
+            ciks = [c for c in ciks if c not in in_global]
 
-        if not idx.exists():
+    for cik in ciks:
+        index = load_faiss_index(cik, form)
+        if index is None:
+            continue
+        params, rows = _company_search_params(cik, form, k, filters)
+        if rows is not None and len(rows) == 0:
             continue
 
-        index = faiss.read_index(str(idx))
-        meta_df = pd.read_parquet(meta)
+        D, I = index.search(q_vec, k, params=params)
+        valid = I[0] >= 0
+        frames.append(fetch_meta_rows(cik, form, I[0][valid]).assign(distance=D[0][valid]))
 
-        D, I = index.search(q_vec, k)
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
 
-        for dist, idx in zip(D[0], I[0]):
-            if idx >= 0:
-                row = meta_df.iloc[idx].copy()
-                row["distance"] = float(dist)
-                results.append(row)
+    df = pd.concat(frames)
+    return df.sort_values("distance").head(k)
 
-    if not results:
-        return pd.DataFrame()
 
-    df = pd.DataFrame(results)
-    df = df.sort_values("distance").head(k)
+def multi_search(query: str, cik_list: list, form="10-K", k=5, mode: str = None,
+                 filters: dict = None) -> pd.DataFrame:
+    """
+    Search across multiple companies and merge results.
 
-    return df
+    Companies present in the global index are searched together in one
+    filtered FAISS query; any others fall back to their per-CIK index.
+    mode="hybrid" additionally fuses in per-company BM25 matches.
+    `filters` apply to every company, inside FAISS.
+    """
+    mode = mode or RETRIEVAL_MODE
+    q_vec = embed_queries([query])
+    ciks = list(dict.fromkeys(normalize_cik(c) for c in cik_list))
+
+    if mode != "hybrid":
+        return _multi_vector_search(q_vec, ciks, form, k, filters)
+
+    n = k * HYBRID_CANDIDATES
+    dense = _multi_vector_search(q_vec, ciks, form, n, filters)
+    lexical = [_lexical_hits(query, cik, form, n, filters) for cik in ciks]
+    lexical = [df for df in lexical if not df.empty]
+    if lexical:
+        lexical = pd.concat(lexical).sort_values("bm25", ascending=False).head(n)
+    else:
+        lexical = pd.DataFrame()
+    return _rrf_fuse([dense, lexical], k)
@@ -0,0 +1,165 @@
+# helper_lib/sec_cache.py
+
+"""
+Disk cache for parsed SEC API responses with HTTP revalidation.
+
+Each entry is the *parsed* result of a response (a DataFrame stored as
+parquet, or a JSON-able dict), not the raw body, plus a small .meta.json
+holding the URL, ETag, Last-Modified and when it was last validated:
+
+    data/sec_cache/{namespace}/{key}.parquet | .json
+    data/sec_cache/{namespace}/{key}.meta.json
+
+`cached_fetch`:
+- younger than `max_age` seconds: returned from disk, no request
+- older: conditional GET (If-None-Match / If-Modified-Since); a 304 only
+  refreshes the timestamp, a 200 is parsed and replaces the entry
+- request fails but an entry exists: the stale entry is served
+
+Counters per namespace (memory-layer hits reported by callers, fresh disk
+hits, 304s, full fetches, stale fallbacks, fetch latency) are available
+from `cache_stats`.
+"""
+
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from .utils import DATA_DIR
+from .sec_client import sec_get
+
+SEC_CACHE_DIR = DATA_DIR / "sec_cache"
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _paths(namespace: str, key: str, fmt: str):
+    d = SEC_CACHE_DIR / namespace
+    d.mkdir(parents=True, exist_ok=True)
+    return d / f"{key}.{fmt}", d / f"{key}.meta.json"
+
+
+def _load(path, fmt: str):
+    if fmt == "parquet":
+        return pd.read_parquet(path)
+    return json.loads(path.read_text())
+
+
+def _tmp(path):
+    # Unique per thread so concurrent refreshes of one key don't collide
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _save(path, value, fmt: str):
+    tmp = _tmp(path)
+    if fmt == "parquet":
+        value.to_parquet(tmp, index=False)
+    else:
+        tmp.write_text(json.dumps(value))
+    tmp.replace(path)
+
+
+def _write_meta(meta_path, meta: dict):
+    tmp = _tmp(meta_path)
+    tmp.write_text(json.dumps(meta))
+    tmp.replace(meta_path)
+
+
+def record_hit(namespace: str, outcome: str = "memory"):
+    """Counts a hit served by a caller's own in-memory layer."""
+    _count(namespace, outcome)
+
+
+def _count(namespace: str, outcome: str, fetch_s: float = None):
+    with _stats_lock:
+        s = _stats.setdefault(namespace, {
+            "memory": 0, "fresh": 0, "not_modified": 0, "fetched": 0, "stale": 0,
+            "fetch_seconds": 0.0, "requests": 0,
+        })
+        s[outcome] += 1
+        if fetch_s is not None:
+            s["requests"] += 1
+            s["fetch_seconds"] += fetch_s
+
+
+def cached_fetch(namespace: str, key: str, url: str, parse, max_age: float, fmt: str = "json"):
+    """
+    Parsed value for `url`, from disk when fresh or unchanged on SEC.
+    `parse(response)` turns a 200 response into the value to store.
+    """
+    data_path, meta_path = _paths(namespace, key, fmt)
+    meta = json.loads(meta_path.read_text()) if meta_path.exists() and data_path.exists() else None
+
+    if meta and time.time() - meta["validated_at"] < max_age:
+        _count(namespace, "fresh")
+        return _load(data_path, fmt)
+
+    headers = {}
+    if meta and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    t0 = time.perf_counter()
+    try:
+        r = sec_get(url, headers=headers)
+        if r.status_code != 304:
+            r.raise_for_status()
+    except Exception as e:
+        if meta is None:
+            raise
+        print(f"⚠️ {namespace}/{key}: SEC request failed ({e}), serving cached copy")
+        _count(namespace, "stale")
+        return _load(data_path, fmt)
+    elapsed = time.perf_counter() - t0
+
+    if r.status_code == 304:
+        meta["validated_at"] = time.time()
+        _write_meta(meta_path, meta)
+        _count(namespace, "not_modified", elapsed)
+        return _load(data_path, fmt)
+
+    value = parse(r)
+    _save(data_path, value, fmt)
+    _write_meta(meta_path, {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "validated_at": time.time(),
+    })
+    _count(namespace, "fetched", elapsed)
+    return value
+
+
+def peek(namespace: str, key: str, fmt: str = "json"):
+    """(value, age_seconds) of an entry without any network call, or None."""
+    data_path, meta_path = _paths(namespace, key, fmt)
+    if not (data_path.exists() and meta_path.exists()):
+        return None
+    meta = json.loads(meta_path.read_text())
+    return _load(data_path, fmt), time.time() - meta["validated_at"]
+
+
+def cache_stats() -> dict:
+    """Per-namespace outcome counts, hit rate and mean SEC fetch latency."""
+    out = {}
+    with _stats_lock:
+        for ns, s in _stats.items():
+            hits = s["memory"] + s["fresh"] + s["not_modified"] + s["stale"]
+            total = hits + s["fetched"]
+            out[ns] = {
+                **s,
+                "hit_rate": round(hits / total, 3) if total else None,
+                "mean_fetch_ms": round(1000 * s["fetch_seconds"] / s["requests"], 1) if s["requests"] else None,
+            }
+    return out
+
+
+def invalidate(namespace: str, key: str = None):
+    d = SEC_CACHE_DIR / namespace
+    for p in d.glob(f"{key}.*" if key else "*"):
+        p.unlink()
@@ -0,0 +1,135 @@
+# helper_lib/sec_client.py
+
+"""
+Shared HTTP client for sec.gov / data.sec.gov.
+
+SEC's fair-access policy allows 10 requests per second per client and
+throttles (429 / temporary blocks) beyond that. Every SEC call goes through
+`sec_get`, which:
+- reuses keep-alive connections from one pooled requests.Session
+- takes a token from a process-wide token bucket (SEC_MAX_RPS, default 10)
+  shared by all threads, so concurrent downloads together stay under the limit
+- retries 429/5xx and connection errors with exponential backoff, honouring
+  Retry-After when SEC sends it
+- always sets a timeout
+
+`fetch_many` downloads several URLs concurrently through the same limiter.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .utils import SEC_HEADERS
+
+SEC_MAX_RPS = float(os.getenv("SEC_MAX_RPS", "10"))
+SEC_BURST = float(os.getenv("SEC_BURST", "1"))
+SEC_TIMEOUT = float(os.getenv("SEC_TIMEOUT", "30"))
+SEC_MAX_RETRIES = int(os.getenv("SEC_MAX_RETRIES", "5"))
+SEC_FETCH_WORKERS = int(os.getenv("SEC_FETCH_WORKERS", "8"))
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/second, at most `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_bucket = TokenBucket(SEC_MAX_RPS, SEC_BURST)
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            s.headers.update(SEC_HEADERS)
+            pool = max(10, SEC_FETCH_WORKERS)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def _retry_delay(attempt: int, resp=None) -> float:
+    if resp is not None:
+        after = resp.headers.get("Retry-After")
+        if after and after.isdigit():
+            return float(after)
+    return min(60.0, 2 ** attempt) + random.uniform(0, 0.5)
+
+
+def sec_get(url: str, **kwargs) -> requests.Response:
+    """
+    Rate-limited GET with retries. Returns the last response (callers still
+    check status / raise_for_status); raises if every attempt failed to
+    connect.
+    """
+    kwargs.setdefault("timeout", SEC_TIMEOUT)
+    session = get_session()
+    for attempt in range(SEC_MAX_RETRIES + 1):
+        _bucket.acquire()
+        try:
+            resp = session.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == SEC_MAX_RETRIES:
+                raise
+            delay = _retry_delay(attempt)
+            print(f"⚠️ SEC request failed ({type(e).__name__}), retrying in {delay:.1f}s: {url}")
+            time.sleep(delay)
+            continue
+
+        if resp.status_code not in _RETRY_STATUS or attempt == SEC_MAX_RETRIES:
+            return resp
+        delay = _retry_delay(attempt, resp)
+        print(f"⚠️ SEC returned {resp.status_code}, retrying in {delay:.1f}s: {url}")
+        time.sleep(delay)
+    return resp
+
+
+def sec_get_json(url: str) -> dict:
+    r = sec_get(url)
+    r.raise_for_status()
+    return r.json()
+
+
+def fetch_many(items, fn=None, workers: int = None) -> list:
+    """
+    Runs fn(item) (default: sec_get on a URL) for each item on a thread pool
+    and returns the results in input order. Throughput is capped by the
+    shared bucket, not by the worker count.
+    """
+    items = list(items)
+    fn = fn or sec_get
+    workers = max(1, min(workers or SEC_FETCH_WORKERS, len(items) or 1))
+    if workers == 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, items))
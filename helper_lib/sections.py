@@ -0,0 +1,209 @@
+# helper_lib/sections.py
+
+"""
+10-K / 10-Q Item detection on cleaned filing text.
+
+Headings are short lines outside [TABLE START] blocks that start with
+"Item 1A." / "ITEM 7 —" etc. and carry at most a title after the number,
+so cross-references in prose ("Item 7 of this report ...") are not
+headings. The table of contents repeats every heading a line or two
+apart, so a heading only counts if its section runs for at least
+MIN_SECTION_CHARS before the next one. The body starts at the first
+occurrence of the earliest Item; everything before it (cover page, TOC)
+is labelled "Cover". From there Items must increase: an out-of-order
+"Item 1A" line inside MD&A is a cross-reference and stays in MD&A.
+
+Labels are "Item 1A" for 10-K style filings and "Part II Item 1A" for
+10-Qs, whose Items restart in each Part. `expand_sections` turns user
+input ("1A", "risk factors", "MD&A", "Item 7") into the stored labels so
+the `sections` search filter can take either.
+"""
+
+import re
+
+MIN_SECTION_CHARS = 400
+# Longer lines starting with "Item N" are prose, not headings
+MAX_HEADING_CHARS = 200
+
+ITEM_TITLES = {
+    "1": "Business",
+    "1A": "Risk Factors",
+    "1B": "Unresolved Staff Comments",
+    "1C": "Cybersecurity",
+    "2": "Properties",
+    "3": "Legal Proceedings",
+    "4": "Mine Safety Disclosures",
+    "5": "Market for Registrant's Common Equity",
+    "6": "Reserved",
+    "7": "Management's Discussion and Analysis",
+    "7A": "Quantitative and Qualitative Disclosures About Market Risk",
+    "8": "Financial Statements and Supplementary Data",
+    "9": "Changes in and Disagreements with Accountants",
+    "9A": "Controls and Procedures",
+    "9B": "Other Information",
+    "9C": "Disclosure Regarding Foreign Jurisdictions that Prevent Inspections",
+    "10": "Directors, Executive Officers and Corporate Governance",
+    "11": "Executive Compensation",
+    "12": "Security Ownership",
+    "13": "Certain Relationships and Related Transactions",
+    "14": "Principal Accountant Fees and Services",
+    "15": "Exhibits and Financial Statement Schedules",
+    "16": "Form 10-K Summary",
+}
+
+# Common names for sections -> labels across 10-K and 10-Q
+SECTION_ALIASES = {
+    "business": ["Item 1"],
+    "risk factors": ["Item 1A", "Part II Item 1A"],
+    "risk": ["Item 1A", "Part II Item 1A"],
+    "cybersecurity": ["Item 1C"],
+    "legal proceedings": ["Item 3", "Part II Item 1"],
+    "md&a": ["Item 7", "Part I Item 2"],
+    "mda": ["Item 7", "Part I Item 2"],
+    "management's discussion and analysis": ["Item 7", "Part I Item 2"],
+    "market risk": ["Item 7A", "Part I Item 3"],
+    "financial statements": ["Item 8", "Part I Item 1"],
+    "controls and procedures": ["Item 9A", "Part I Item 4"],
+    "executive compensation": ["Item 11"],
+    "exhibits": ["Item 15", "Part II Item 6"],
+    "cover": ["Cover"],
+}
+
+_ITEM_RE = re.compile(r"^\s*item\s+(\d{1,2}[abc]?)\s*(?:([.:\-–—])|\s|$)", re.IGNORECASE)
+# A sentence break inside the title: "Item 1A. Risk Factors. The following ..."
+_SENTENCE_RE = re.compile(r"[.;]\s+\S")
+_PART_RE = re.compile(r"^\s*part\s+(iv|iii|ii|i)\b", re.IGNORECASE)
+
+_ITEM_ORDER = {item: i for i, item in enumerate(ITEM_TITLES)}
+_PART_ORDER = {"I": 0, "II": 1, "III": 2, "IV": 3}
+
+
+def _rank(label: str) -> tuple:
+    words = label.split()
+    part = _PART_ORDER.get(words[1], 0) if words[0] == "Part" else 0
+    return part, _ITEM_ORDER.get(words[-1], len(_ITEM_ORDER))
+
+
+def _is_quarterly(form: str) -> bool:
+    return str(form).upper().startswith("10-Q")
+
+
+def _is_heading(line: str, m) -> bool:
+    """An Item line followed by nothing, or by a title, rather than prose."""
+    stripped = line.strip()
+    if len(stripped) > MAX_HEADING_CHARS:
+        return False
+    rest = line[m.end():].strip().lstrip(".:-–— ")
+    if not rest:
+        return True
+    # "Item 7 of this report", "Item 1A, above": a reference, not a title
+    if not m.group(2) and not (rest[0].isupper() or rest[0].isdigit() or rest[0] in "\"'“‘("):
+        return False
+    return not _SENTENCE_RE.search(rest.rstrip(".:"))
+
+
+def find_headings(text: str, form: str = "10-K") -> list:
+    """(char_offset, label) for every Item heading line outside tables."""
+    quarterly = _is_quarterly(form)
+    headings, part, in_table, pos = [], None, False, 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped == "[TABLE START]":
+            in_table = True
+        elif stripped == "[TABLE END]":
+            in_table = False
+        elif not in_table:
+            m = _PART_RE.match(line)
+            if m:
+                part = m.group(1).upper()
+            m = _ITEM_RE.match(line)
+            if m and m.group(1).upper().lstrip("0") in ITEM_TITLES and _is_heading(line, m):
+                item = m.group(1).upper().lstrip("0")
+                label = f"Item {item}"
+                if quarterly and part:
+                    label = f"Part {part} {label}"
+                headings.append((pos, label))
+        pos += len(line)
+    return headings
+
+
+def _ordered_run(headings: list) -> list:
+    """
+    The body's headings: the longest run of non-decreasing Items starting
+    at the first occurrence of the earliest one. Headings before it (cover,
+    TOC) and out-of-order ones (cross-references on a line of their own)
+    are dropped, so their text stays in the surrounding section.
+    """
+    if not headings:
+        return []
+    ranks = [_rank(label) for _, label in headings]
+    first_rank = min(ranks)
+    start = ranks.index(first_rank)
+    # A TOC entry that survived the length filter: the same Item again next
+    while start + 1 < len(headings) and headings[start + 1][1] == headings[start][1]:
+        start += 1
+
+    # Longest non-decreasing subsequence from `start` (a filing has at most
+    # a few dozen headings, so O(n^2) is fine); ties keep the earlier heading
+    n = len(headings)
+    best, prev = [0] * n, [-1] * n
+    best[start] = 1
+    for j in range(start + 1, n):
+        for i in range(start, j):
+            if best[i] and ranks[i] <= ranks[j] and best[i] + 1 > best[j]:
+                best[j], prev[j] = best[i] + 1, i
+    j = max(range(n), key=lambda k: (best[k], -k))
+    run = []
+    while j >= 0:
+        run.append(headings[j])
+        j = prev[j]
+    return run[::-1]
+
+
+def split_sections(text: str, form: str = "10-K") -> list:
+    """[(label, section_text)] in document order, covering all of `text`."""
+    headings = find_headings(text, form)
+
+    # Drop TOC-style headings: ones followed almost immediately by another
+    kept = []
+    for i, (pos, label) in enumerate(headings):
+        nxt = headings[i + 1][0] if i + 1 < len(headings) else len(text)
+        if nxt - pos >= MIN_SECTION_CHARS:
+            kept.append((pos, label))
+
+    kept = _ordered_run(kept)
+
+    sections = []
+    first = kept[0][0] if kept else len(text)
+    if text[:first].strip():
+        sections.append(("Cover", text[:first]))
+    for i, (pos, label) in enumerate(kept):
+        end = kept[i + 1][0] if i + 1 < len(kept) else len(text)
+        body = text[pos:end]
+        # A label can recur (e.g. a heading repeated after a page break); merge it
+        if sections and sections[-1][0] == label:
+            sections[-1] = (label, sections[-1][1] + body)
+        else:
+            sections.append((label, body))
+    return sections
+
+
+def expand_sections(names) -> list:
+    """Stored section labels matching user-supplied names / item numbers."""
+    out = []
+    for name in names or []:
+        key = str(name).strip()
+        low = key.lower()
+        if low in SECTION_ALIASES:
+            out.extend(SECTION_ALIASES[low])
+            continue
+        m = re.fullmatch(r"(?:part\s+(iv|iii|ii|i)\s*,?\s*)?(?:item\s*)?(\d{1,2}[abc]?)", low)
+        if m:
+            item = m.group(2).upper().lstrip("0")
+            if m.group(1):
+                out.append(f"Part {m.group(1).upper()} Item {item}")
+            else:
+                out.extend([f"Item {item}", f"Part I Item {item}", f"Part II Item {item}"])
+            continue
+        out.append(key)
+    return list(dict.fromkeys(out))
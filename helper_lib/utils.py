@@ -1,11 +1,17 @@
 # helper_lib/utils.py
 import os
 import re
+from contextlib import contextmanager
 from pathlib import Path
 from bs4 import BeautifulSoup
 import tiktoken
+import numpy as np
 import pandas as pd
-import requests  # Added for Ticker lookup
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: in-process locks only
+    fcntl = None
 
 # Paths
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -13,15 +19,37 @@ DATA_DIR = ROOT_DIR / "data"
 RAW_DIR = DATA_DIR / "raw_filings"
 CHUNK_DIR = DATA_DIR / "chunks"
 INDEX_DIR = DATA_DIR / "indexes"
+EMBED_CACHE_DIR = DATA_DIR / "embeddings"
 
-for d in [DATA_DIR, RAW_DIR, CHUNK_DIR, INDEX_DIR]:
+for d in [DATA_DIR, RAW_DIR, CHUNK_DIR, INDEX_DIR, EMBED_CACHE_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
+@contextmanager
+def file_lock(path: Path):
+    """
+    Exclusive advisory lock on `path` (created if missing) shared by every
+    process on the host, e.g. the uvicorn workers writing the same cache
+    files. Pair it with a threading.Lock: flock does not serialise threads
+    that open the file separately on every platform.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 # Headers
 SEC_HEADERS = {
     "User-Agent": os.getenv("SEC_USER_AGENT", "academic_project@university.edu")
 }
 
+# Ticker -> CIK map is cached on disk and revalidated after this many seconds
+TICKERS_MAX_AGE = float(os.getenv("TICKERS_MAX_AGE", "86400"))
+
 def get_cik_from_ticker(ticker: str) -> str:
     """
     Fetches the SEC's official ticker-to-CIK mapping.
@@ -29,9 +57,9 @@ def get_cik_from_ticker(ticker: str) -> str:
     try:
         print(f"🔍 Looking up CIK for ticker: {ticker}...")
         url = "https://www.sec.gov/files/company_tickers.json"
-        r = requests.get(url, headers=SEC_HEADERS)
-        r.raise_for_status()
-        data = r.json()
+        # sec_cache imports SEC_HEADERS / DATA_DIR from here
+        from .sec_cache import cached_fetch
+        data = cached_fetch("tickers", "company_tickers", url, parse=lambda r: r.json(), max_age=TICKERS_MAX_AGE)
         
         ticker_upper = ticker.upper().strip()
         
@@ -89,7 +117,112 @@ def clean_html_text(html_content: str) -> str:
 
 _tokenizer = tiktoken.get_encoding("cl100k_base")
 
-def chunk_text(text: str, max_tokens: int = 1000, overlap: int = 200) -> list:
+# Snap chunk ends back to a table edge / line break / sentence end found in
+# the last CHUNK_SNAP_SLACK of the window (CHUNK_SNAP=1 to enable)
+CHUNK_SNAP = os.getenv("CHUNK_SNAP", "0") == "1"
+CHUNK_SNAP_SLACK = float(os.getenv("CHUNK_SNAP_SLACK", "0.15"))
+
+_SNAP_PATTERNS = [
+    re.compile(r"\n(?=\[TABLE START\])|\[TABLE END\]\n"),  # table edges
+    re.compile(r"\n"),                                        # paragraphs / table rows
+    re.compile(r"[.!?][\"')\]]?\s"),                         # sentence ends
+]
+
+_token_nbytes = None
+
+def _token_byte_lengths(tokens) -> np.ndarray:
+    """UTF-8 byte length of each token, via a per-vocabulary lookup table."""
+    global _token_nbytes
+    if _token_nbytes is None:
+        table = np.zeros(_tokenizer.n_vocab, dtype="int64")
+        for t in range(_tokenizer.n_vocab):
+            try:
+                table[t] = len(_tokenizer.decode_single_token_bytes(t))
+            except KeyError:
+                pass
+        _token_nbytes = table
+    return _token_nbytes[np.asarray(tokens, dtype="int64")]
+
+def _token_char_offsets(text: str, tokens) -> np.ndarray:
+    """
+    Character offset where each token starts, plus len(text) at the end.
+    A token that starts inside a multi-byte character maps to the next
+    character boundary.
+    """
+    cum = np.zeros(len(tokens) + 1, dtype="int64")
+    np.cumsum(_token_byte_lengths(tokens), out=cum[1:])
+    if text.isascii():
+        return cum
+    raw = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    # chars_before[b] = number of characters starting in raw[:b]
+    chars_before = np.zeros(len(raw) + 1, dtype="int64")
+    np.cumsum((raw & 0xC0) != 0x80, out=chars_before[1:])
+    return chars_before[np.minimum(cum, len(raw))]
+
+def _snap_end(text: str, lo: int, hi: int) -> int:
+    """Latest structural boundary in text[lo:hi], or hi if there is none."""
+    window = text[lo:hi]
+    for pattern in _SNAP_PATTERNS:
+        last = None
+        for last in pattern.finditer(window):
+            pass
+        if last is not None:
+            return lo + last.end()
+    return hi
+
+def _chunk_by_offsets(text: str, offsets: np.ndarray, max_tokens: int, overlap: int, snap: bool) -> list:
+    n = len(offsets) - 1
+    step = max_tokens - overlap
+    if not snap:
+        starts = np.arange(0, n, step)
+        ends = np.minimum(starts + max_tokens, n)
+        return [text[a:b] for a, b in zip(offsets[starts].tolist(), offsets[ends].tolist())]
+
+    chunks, start, lo_char = [], 0, 0
+    slack = max(1, int(max_tokens * CHUNK_SNAP_SLACK))
+    while start < n:
+        end = min(start + max_tokens, n)
+        end_char = int(offsets[end])
+        if end < n:
+            end_char = _snap_end(text, int(offsets[max(start + 1, end - slack)]), end_char)
+            # first token starting at/after the snapped position
+            end = max(start + 1, int(np.searchsorted(offsets, end_char, side="left")))
+        chunks.append(text[lo_char:end_char])
+        if end >= n:
+            break
+        start = max(start + 1, end - overlap)
+        # The snapped end can fall inside a token. Never start the next chunk
+        # past it, or the characters in between belong to no chunk; the
+        # window then counts from the token holding that position.
+        lo_char = min(int(offsets[start]), end_char)
+        start = int(np.searchsorted(offsets, lo_char, side="right")) - 1
+    return chunks
+
+def chunk_texts(texts: list, max_tokens: int = 1000, overlap: int = 200, snap: bool = None) -> list:
+    """
+    Token-window chunks for several documents at once. Texts are encoded in
+    one batch call; each document is then cut by character offsets of the
+    window boundaries, so nothing is decoded per window.
+    """
+    snap = CHUNK_SNAP if snap is None else snap
+    texts = list(texts)
+    if len(texts) == 1 and hasattr(_tokenizer, "encode_to_numpy"):
+        # Straight into a uint32 array, skipping the Python list of ints
+        token_lists = [_tokenizer.encode_to_numpy(texts[0], disallowed_special=())]
+    else:
+        token_lists = _tokenizer.encode_ordinary_batch(texts)
+
+    out = []
+    for text, tokens in zip(texts, token_lists):
+        offsets = _token_char_offsets(text, tokens)
+        out.append(_chunk_by_offsets(text, offsets, max_tokens, overlap, snap))
+    return out
+
+def chunk_text(text: str, max_tokens: int = 1000, overlap: int = 200, snap: bool = None) -> list:
+    return chunk_texts([text], max_tokens, overlap, snap)[0]
+
+def _chunk_text_decode(text: str, max_tokens: int = 1000, overlap: int = 200) -> list:
+    """Previous implementation (decode per window); kept for benchmark_chunk_text."""
     tokens = _tokenizer.encode(text)
     chunks = []
     start = 0
@@ -100,6 +233,35 @@ def chunk_text(text: str, max_tokens: int = 1000, overlap: int = 200) -> list:
         start += max_tokens - overlap
     return chunks
 
+def benchmark_chunk_text(paths=None, limit: int = 10) -> dict:
+    """Times chunk_text against the per-window decode version on stored filings."""
+    import time
+    from .raw_store import iter_raw
+    from .html_text import html_file_to_text
+
+    paths = list(paths) if paths is not None else list(iter_raw())[:limit]
+    texts = [html_file_to_text(p) for p in paths]
+
+    t0 = time.perf_counter()
+    old = [_chunk_text_decode(t) for t in texts]
+    t1 = time.perf_counter()
+    new = chunk_texts(texts, snap=False)
+    t2 = time.perf_counter()
+    chunk_texts(texts, snap=True)
+    t3 = time.perf_counter()
+
+    report = {
+        "files": len(texts),
+        "chunks": sum(len(c) for c in new),
+        "decode_s": round(t1 - t0, 3),
+        "offsets_s": round(t2 - t1, 3),
+        "offsets_snap_s": round(t3 - t2, 3),
+        "identical": old == new,
+    }
+    print(f"✂️ chunk_text on {report['files']} filings: decode {report['decode_s']}s, "
+          f"offsets {report['offsets_s']}s (snap {report['offsets_snap_s']}s), identical={report['identical']}")
+    return report
+
 def save_chunks_df(df: pd.DataFrame, cik: str, form: str):
     path = CHUNK_DIR / f"chunks_{normalize_cik(cik)}_{form}.parquet"
     df.to_parquet(path, index=False)
\ No newline at end of file
@@ -1,86 +1,405 @@
 # helper_lib/xbrl.py
 
-import requests
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
 import pandas as pd
-from .utils import SEC_HEADERS, normalize_cik
+from .utils import normalize_cik
+from .sec_cache import cached_fetch, peek, record_hit, cache_stats
+from .sec_client import fetch_many
+from .fact_store import FACT_COLUMNS, write_company_facts, stored_companies, panel
+from .derived import DERIVED_METRICS, derived_facts
+
+
+# ==========================================================
+# ⭐ Concepts & cache settings
+# ==========================================================
+# Disk entries younger than this are used without asking SEC; older ones
+# are revalidated with a conditional GET (see sec_cache.py)
+XBRL_MAX_AGE = float(os.getenv("XBRL_MAX_AGE", "21600"))
+# In-process layer in front of the disk cache
+XBRL_MEMORY_TTL = float(os.getenv("XBRL_MEMORY_TTL", "300"))
+
+# Tags to extract: label -> us-gaap tags tried in order
+DEFAULT_CONCEPTS = {
+    "Revenues": ["Revenues", "RevenueFromContractWithCustomerExcludingAssessedTax"],
+    "NetIncome": ["NetIncomeLoss"],
+    "Assets": ["Assets"],
+    "Liabilities": ["Liabilities"],
+    "OperatingIncome": ["OperatingIncomeLoss"]
+}
+
+
+def _load_concepts() -> dict:
+    """
+    XBRL_CONCEPTS overrides DEFAULT_CONCEPTS with the same label -> [tags]
+    mapping, either inline JSON or the path of a JSON file.
+    """
+    raw = os.getenv("XBRL_CONCEPTS", "").strip()
+    if not raw:
+        return DEFAULT_CONCEPTS
+    try:
+        spec = Path(raw).read_text() if not raw.startswith("{") else raw
+        concepts = {str(k): [v] if isinstance(v, str) else list(v) for k, v in json.loads(spec).items()}
+    except Exception as e:
+        print(f"⚠️ Ignoring XBRL_CONCEPTS ({e}); using the default concepts")
+        return DEFAULT_CONCEPTS
+    return concepts or DEFAULT_CONCEPTS
+
+
+CONCEPTS = _load_concepts()
+# Part of the disk cache key, so changing the concept list re-extracts
+_CONCEPTS_KEY = hashlib.sha1(json.dumps(CONCEPTS, sort_keys=True).encode()).hexdigest()[:8]
+
+_memory = {}  # cik -> (metrics dict, loaded_at)
+_refreshing = set()
+_memory_lock = threading.Lock()
 
 
 # ==========================================================
 # ⭐ Fetch Key Financial Metrics (ALL Years, Not Just 3)
 # ==========================================================
-def get_key_financial_metrics(cik: str) -> dict:
+# A namespace key ("dei", "us-gaap", ...) followed by its first concept object
+_NAMESPACE_RE = re.compile(rb'"([a-z][a-z0-9-]*)"\s*:\s*\{\s*"[A-Za-z][A-Za-z0-9_]*"\s*:\s*\{\s*"label"')
+# Any concept key inside a namespace: where the previous concept object ends
+_CONCEPT_RE = re.compile(rb'"[A-Za-z][A-Za-z0-9_]*"\s*:\s*\{\s*"label"')
+_decoder = json.JSONDecoder()
+
+
+def _select_concepts(body: bytes, tags) -> dict:
+    """
+    The us-gaap objects of `tags` from a companyfacts body, without parsing
+    or decoding the rest of it.
+
+    companyfacts is {"cik", "entityName", "facts": {namespace: {Tag: {"label",
+    "description", "units"}}}}. Each wanted tag is located in the raw bytes
+    of the us-gaap namespace by its `"Tag": {"label"` key. Only the bytes up
+    to the next concept key are decoded and parsed (quotes inside JSON
+    strings are escaped, so such a key never occurs inside a value). The
+    hundreds of other concepts never become str or Python objects. Returns
+    None when the layout isn't recognised, and the caller falls back to a
+    full parse.
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    start = None
+    for m in _NAMESPACE_RE.finditer(body):
+        if start is None and m.group(1) == b"us-gaap":
+            start = m.end(1)
+        elif start is not None:
+            end = m.start()
+            break
+    else:
+        end = len(body)
+    if start is None:
+        return None
+
+    found = {}
+    for tag in tags:
+        m = re.compile(rb'"%s"\s*:\s*(?=\{\s*"label")' % re.escape(tag.encode())).search(body, start, end)
+        if m:
+            nxt = _CONCEPT_RE.search(body, m.end() + 1, end)
+            chunk = body[m.end():nxt.start() if nxt else end].decode("utf-8")
+            found[tag], _ = _decoder.raw_decode(chunk)
+    return found
+
+
+def parse_companyfacts(body: bytes) -> dict:
+    """Extracted metrics from a raw companyfacts body (selective decode)."""
+    tags = list(dict.fromkeys(t for options in CONCEPTS.values() for t in options))
+    us_gaap = _select_concepts(body, tags)
+    if us_gaap is None:
+        return _extract_metrics(json.loads(body))
+    return _extract_metrics({"facts": {"us-gaap": us_gaap}})
+
+
+def _extract_metrics(raw_data: dict) -> dict:
+    """Per-label list of {end, val, fy, form} rows from a companyfacts payload."""
+    out = {}
+    us_gaap = raw_data.get("facts", {}).get("us-gaap", {})
+
+    for label, tag_options in CONCEPTS.items():
+        found = False
+
+        for tag in tag_options:
+            if tag in us_gaap:
+
+                units_dict = us_gaap[tag]["units"]
+                unit_key = list(units_dict.keys())[0]  # e.g. "USD"
+
+                df = pd.DataFrame(units_dict[unit_key])
+
+                # Keep annual (10-K) filings only
+                if "form" in df.columns:
+                    df = df[df["form"] == "10-K"]
+
+                # Sort newest → oldest and dedupe by fiscal year
+                df = (
+                    df.sort_values("end", ascending=False)
+                      .drop_duplicates(subset=['fy'])  # KEEP ALL YEARS
+                )
+
+                # Save result
+                df = df.assign(tag=tag, unit=unit_key)
+                cols = [c for c in ("end", "val", "fy", "fp", "form", "unit", "tag") if c in df.columns]
+                out[label] = df[cols].to_dict(orient="records")
+                found = True
+                break
+
+        # If tag not found, return empty list
+        if not found:
+            out[label] = []
+
+    return out
+
+def _companyfacts_url(cik: str) -> str:
+    return f"https://data.sec.gov/api/xbrl/companyfacts/CIK{cik}.json"
+
+def _cache_key(cik: str) -> str:
+    return f"{cik}_{_CONCEPTS_KEY}"
+
+def _fetch_metrics(cik: str) -> dict:
+    """Disk cache → conditional GET → parse; result goes into the memory layer."""
+    def parse(r):
+        data = parse_companyfacts(r.content)
+        # New data from SEC: refresh this company in the cross-company fact store
+        write_company_facts(cik, facts_frame(data))
+        return data
+
+    data = cached_fetch("companyfacts", _cache_key(cik), _companyfacts_url(cik), parse=parse, max_age=XBRL_MAX_AGE)
+    with _memory_lock:
+        _memory[cik] = (data, time.time())
+    return data
+
+def _refresh_in_background(cik: str):
+    with _memory_lock:
+        if cik in _refreshing:
+            return
+        _refreshing.add(cik)
+
+    def run():
+        try:
+            _fetch_metrics(cik)
+        except Exception as e:
+            print(f"⚠️ XBRL refresh failed for CIK={cik}: {e}")
+        finally:
+            with _memory_lock:
+                _refreshing.discard(cik)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def get_key_financial_metrics(cik: str, background_refresh: bool = False) -> dict:
     """
     Fetches the SEC 'Company Facts' JSON (XBRL data).
-    Returns a simplified dictionary of key metrics:
-    - Revenue
-    - Net Income
-    - Assets
-    - Liabilities
-    - Operating Income
+    Returns a simplified dictionary of key metrics, one entry per CONCEPTS
+    label (by default Revenues, NetIncome, Assets, Liabilities and
+    OperatingIncome; see XBRL_CONCEPTS).
     
     Returns ALL available fiscal years (not only 3).
+
+    Extracted series are cached in memory (XBRL_MEMORY_TTL) and on disk
+    (XBRL_MAX_AGE, then revalidated). With background_refresh=True any
+    cached copy is returned immediately and revalidation happens on a
+    background thread, so chat turns never wait on SEC once a company has
+    been seen.
     """
 
     cik = normalize_cik(cik)
-    url = f"https://data.sec.gov/api/xbrl/companyfacts/CIK{cik}.json"
 
-    output = {"status": "success", "data": {}}
+    with _memory_lock:
+        cached = _memory.get(cik)
+    if cached and time.time() - cached[1] < XBRL_MEMORY_TTL:
+        record_hit("companyfacts")
+        return {"status": "success", "data": cached[0]}
 
     try:
-        r = requests.get(url, headers=SEC_HEADERS)
-        if r.status_code != 200:
-            return {"status": "error", "message": f"SEC API Error: {r.status_code}"}
-
-        raw_data = r.json()
-        us_gaap = raw_data.get("facts", {}).get("us-gaap", {})
-
-        # Tags to extract
-        concepts = {
-            "Revenues": ["Revenues", "RevenueFromContractWithCustomerExcludingAssessedTax"],
-            "NetIncome": ["NetIncomeLoss"],
-            "Assets": ["Assets"],
-            "Liabilities": ["Liabilities"],
-            "OperatingIncome": ["OperatingIncomeLoss"]
+        on_disk = peek("companyfacts", _cache_key(cik)) if background_refresh else None
+        if on_disk is not None:
+            data, age = on_disk
+            with _memory_lock:
+                _memory[cik] = (data, time.time())
+            if age < XBRL_MAX_AGE:
+                record_hit("companyfacts", "fresh")
+            else:
+                record_hit("companyfacts", "stale")
+                _refresh_in_background(cik)
+            return {"status": "success", "data": data}
+
+        return {"status": "success", "data": _fetch_metrics(cik)}
+
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+def facts_frame(data: dict) -> pd.DataFrame:
+    """
+    get_key_financial_metrics()["data"] as fact-store rows, derived metrics
+    (derived.py) included so they are stored and replaced with the base facts.
+    """
+    rows = [
+        {
+            "concept": label,
+            "tag": r.get("tag", ""),
+            "fy": r.get("fy"),
+            "fp": r.get("fp", "FY"),
+            "end": r.get("end"),
+            "val": r.get("val"),
+            "unit": r.get("unit", ""),
+            "form": r.get("form", ""),
         }
+        for label, records in data.items()
+        for r in records
+    ]
+    base = pd.DataFrame(rows, columns=[c for c in FACT_COLUMNS if c != "cik"])
+    derived = derived_facts(base)
+    return pd.concat([base, derived], ignore_index=True) if len(derived) else base
+
+
+def ensure_facts(ciks) -> list:
+    """
+    Makes sure every company is in the fact store and not stale. Missing
+    companies are fetched concurrently; stored ones go through the same
+    cache as chat (get_key_financial_metrics with background_refresh), so
+    they are revalidated in the background once older than XBRL_MAX_AGE.
+    Returns the normalized CIKs.
+    """
+    ciks = [normalize_cik(c) for c in ciks]
 
-        for label, tag_options in concepts.items():
-            found = False
+    def fill(cik):
+        res = get_key_financial_metrics(cik, background_refresh=True)
+        # A fresh download already stored the company (see _fetch_metrics);
+        # this covers companies whose metrics came from an older cache entry
+        if res["status"] == "success" and cik not in stored_companies():
+            write_company_facts(cik, facts_frame(res["data"]))
 
-            for tag in tag_options:
-                if tag in us_gaap:
+    fetch_many(list(dict.fromkeys(ciks)), fill)
+    return ciks
 
-                    units_dict = us_gaap[tag]["units"]
-                    unit_key = list(units_dict.keys())[0]  # e.g. "USD"
 
-                    df = pd.DataFrame(units_dict[unit_key])
+def get_kpi_panel(ciks, concepts=("Revenues", "NetIncome"), years=None) -> dict:
+    """
+    {concept: fy × cik DataFrame} for several companies at once, served
+    from the fact store.
+    """
+    ciks = ensure_facts(ciks)
+    return {concept: panel(concept, ciks, years) for concept in concepts}
 
-                    # Keep annual (10-K) filings only
-                    if "form" in df.columns:
-                        df = df[df["form"] == "10-K"]
 
-                    # Sort newest → oldest and dedupe by fiscal year
-                    df = (
-                        df.sort_values("end", ascending=False)
-                          .drop_duplicates(subset=['fy'])  # KEEP ALL YEARS
-                    )
+def compare_companies(companies, concepts=("Revenues", "NetIncome"), years=None) -> dict:
+    """
+    Year-aligned KPI matrix for any number of companies (CIKs or tickers).
 
-                    # Save result
-                    output["data"][label] = df[["end", "val", "fy", "form"]].to_dict(orient="records")
-                    found = True
-                    break
+    Missing companies are fetched concurrently and stale ones revalidated
+    in the background (ensure_facts). Every concept comes back as one
+    column per company over the same fiscal years, None where a company
+    has no value:
 
-            # If tag not found, return empty list
-            if not found:
-                output["data"][label] = []
+    {
+        "companies": [{"id": "AAPL", "cik": "0000320193"}, ...],
+        "years": [2019, 2020, ...],
+        "series": {"Revenues": {"AAPL": [...], ...}, ...}
+    }
+    """
+    ids = list(dict.fromkeys(str(c).strip() for c in companies if str(c).strip()))
+    ciks = fetch_many(ids, normalize_cik)
+    panels = get_kpi_panel(list(dict.fromkeys(ciks)), concepts=concepts, years=years)
 
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    # Years where at least one company reports at least one concept
+    all_years = sorted(set().union(*(df.dropna(how="all").index for df in panels.values())))
+    if years is not None:
+        all_years = sorted(years)
+
+    series = {}
+    for concept, df in panels.items():
+        df = df.reindex(all_years)
+        series[concept] = {
+            ident: [None if pd.isna(v) else _num(v) for v in df[cik]]
+            for ident, cik in zip(ids, ciks)
+        }
+    return {
+        "companies": [{"id": ident, "cik": cik} for ident, cik in zip(ids, ciks)],
+        "years": [int(y) for y in all_years],
+        "series": series,
+    }
 
-    return output
+
+def known_concepts() -> tuple:
+    """Every concept name the fact store can hold: CONCEPTS labels plus derived metrics."""
+    return tuple(dict.fromkeys([*CONCEPTS, *DERIVED_METRICS]))
+
+
+def derived_concepts() -> tuple:
+    """
+    Derived metrics computable from the configured CONCEPTS. Companies
+    stored before a metric existed get it when their facts are next
+    refreshed, or all at once with `python -m helper_lib.derived`.
+    """
+    return tuple(
+        name for name, (_, needs) in DERIVED_METRICS.items()
+        if all(n in CONCEPTS for n in needs)
+    )
+
+
+def get_derived_metrics(ciks, years=None) -> dict:
+    """{metric: fy × cik DataFrame} of margins / growth / CAGR / leverage."""
+    return get_kpi_panel(ciks, concepts=derived_concepts(), years=years)
+
+
+def panel_to_json(panels: dict) -> dict:
+    """{concept: {fy: {cik: value}}}, compact enough for a prompt."""
+    out = {}
+    for concept, df in panels.items():
+        df = df.astype(object).where(df.notna(), None)
+        out[concept] = {str(fy): row for fy, row in df.to_dict(orient="index").items()}
+    return out
+
+
+def benchmark_companyfacts_parse(body: bytes) -> dict:
+    """
+    Parse time and peak traced memory of a companyfacts body, full
+    json.loads (the old r.json() path) vs parse_companyfacts.
+    """
+    def measure(fn):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return out, elapsed, peak
+
+    full, full_s, full_peak = measure(lambda: _extract_metrics(json.loads(body)))
+    sel, sel_s, sel_peak = measure(lambda: parse_companyfacts(body))
+    report = {
+        "body_mb": round(len(body) / 1e6, 2),
+        "full_s": round(full_s, 3),
+        "full_peak_mb": round(full_peak / 1e6, 1),
+        "selective_s": round(sel_s, 3),
+        "selective_peak_mb": round(sel_peak / 1e6, 1),
+        "identical": full == sel,
+    }
+    print(f"🧪 companyfacts {report['body_mb']} MB: json.loads {report['full_s']}s / "
+          f"{report['full_peak_mb']} MB peak, selective {report['selective_s']}s / "
+          f"{report['selective_peak_mb']} MB peak")
+    return report
+
+
+def xbrl_cache_stats() -> dict:
+    """Hit rate and SEC fetch latency of the companyfacts cache."""
+    stats = cache_stats().get("companyfacts", {})
+    with _memory_lock:
+        stats["memory_entries"] = len(_memory)
+    return stats
 
 
 # ==========================================================
-# ⭐ Comparison Helper (used by /compare_kpis)
+# ⭐ Comparison Helper (used by /compare_kpis; see compare_companies for N companies)
 # ==========================================================
 def get_company_kpis_for_compare(cik: str) -> dict:
     """
@@ -95,26 +414,23 @@ def get_company_kpis_for_compare(cik: str) -> dict:
     }
     """
 
-    data = get_key_financial_metrics(cik)
-
     out = {"cik": cik, "years": [], "revenue": [], "net_income": []}
 
-    if data["status"] != "success":
+    panels = get_kpi_panel([cik], concepts=("Revenues", "NetIncome"))
+    rev = panels["Revenues"].iloc[:, 0].dropna()
+    if rev.empty:
         return out
 
-    rev_list = data["data"].get("Revenues", [])
-    ni_list = data["data"].get("NetIncome", [])
-
-    # Sort chronologically (oldest → newest)
-    rev_list = sorted(rev_list, key=lambda x: x["fy"])
-    ni_list = sorted(ni_list, key=lambda x: x["fy"])
+    # Years come from the revenue series (oldest → newest); net income aligned to them
+    ni = panels["NetIncome"].iloc[:, 0].reindex(rev.index)
+    out["years"] = [int(fy) for fy in rev.index]
+    out["revenue"] = [_num(v) for v in rev]
+    out["net_income"] = [None if pd.isna(v) else _num(v) for v in ni]
 
-    # Extract aligned values
-    out["years"] = [item["fy"] for item in rev_list]
-    out["revenue"] = [item["val"] for item in rev_list]
+    return out
 
-    # Fill missing years in Net Income if needed
-    ni_by_year = {item["fy"]: item["val"] for item in ni_list}
-    out["net_income"] = [ni_by_year.get(fy, None) for fy in out["years"]]
 
-    return out
+def _num(v):
+    """Plain int for whole-dollar values (as the JSON had), float otherwise."""
+    v = float(v)
+    return int(v) if v.is_integer() else v
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from helper_lib.utils import _chunk_by_offsets, _chunk_text_decode, chunk_text, chunk_texts
+
+TEXT = (
+    "Net sales increased 8% compared to the prior year.\n"
+    "[TABLE START]\n"
+    "Segment | 2023 | 2022\n"
+    "Americas | 162,560 | 169,658\n"
+    "[TABLE END]\n"
+    "Gross margin was 44.1%. Operating expenses rose modestly!\n"
+    "Café sales in Zürich and São Paulo were strong.\n"
+) * 40
+
+
+def _fixed_offsets(text: str, width: int) -> np.ndarray:
+    """Offsets of `width`-character tokens, so boundaries fall mid-token."""
+    return np.append(np.arange(0, len(text), width), len(text))
+
+
+@pytest.mark.parametrize("width", [3, 5, 7])
+@pytest.mark.parametrize("max_tokens,overlap", [(40, 0), (40, 1), (40, 3), (25, 10)])
+def test_snapped_chunks_cover_every_character(width, max_tokens, overlap):
+    offsets = _fixed_offsets(TEXT, width)
+    chunks = _chunk_by_offsets(TEXT, offsets, max_tokens, overlap, snap=True)
+
+    # Each chunk continues the text: no gap, at most the overlap repeated
+    pos = 0
+    for chunk in chunks:
+        start = TEXT.find(chunk, max(0, pos - (overlap + 1) * width))
+        assert 0 <= start <= pos
+        pos = start + len(chunk)
+    assert pos == len(TEXT)
+    if overlap == 0:
+        assert "".join(chunks) == TEXT
+
+    # A chunk spans at most max_tokens tokens, counting a partial first one
+    for chunk in chunks:
+        assert len(chunk) <= max_tokens * width
+
+
+def test_snapped_chunks_end_on_boundaries():
+    chunks = _chunk_by_offsets(TEXT, _fixed_offsets(TEXT, 5), 80, 0, snap=True)
+    assert all(c.endswith(("\n", ". ", "! ")) for c in chunks[:-1])
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(50, 0), (50, 10), (200, 40)])
+def test_offset_chunks_match_decoded_windows(max_tokens, overlap):
+    assert chunk_text(TEXT, max_tokens, overlap, snap=False) == _chunk_text_decode(TEXT, max_tokens, overlap)
+
+
+def test_batch_matches_single():
+    texts = [TEXT, TEXT[:500], "", "Short filing."]
+    assert chunk_texts(texts, 64, 8, snap=False) == [chunk_text(t, 64, 8, snap=False) for t in texts]
+    assert chunk_texts(texts, 64, 8, snap=True) == [chunk_text(t, 64, 8, snap=True) for t in texts]
+
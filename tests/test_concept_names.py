@@ -0,0 +1,32 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from helper_lib import fact_store
+from helper_lib.xbrl import known_concepts
+
+
+@pytest.mark.parametrize("name", ["../../x", "a/b", "..\\x", "..", "", "companies", "nul\0"])
+def test_concept_path_rejects_names_outside_the_store(name):
+    with pytest.raises(ValueError):
+        fact_store._concept_path(name)
+
+
+def test_concept_path_accepts_known_concepts():
+    for name in known_concepts():
+        assert fact_store._concept_path(name).parent == fact_store.FACTS_DIR
+
+
+@pytest.mark.parametrize("concepts", [["../../x"], ["Revenues", "../../etc/passwd"], ["NoSuchConcept"]])
+def test_compare_batch_rejects_unknown_concepts(concepts, monkeypatch):
+    monkeypatch.setattr(main, "compare_companies", lambda *a, **kw: pytest.fail("should not be reached"))
+    resp = TestClient(main.app).post("/compare_kpis_batch", json={"companies": ["320193"], "concepts": concepts})
+    assert resp.status_code == 400
+
+
+def test_compare_batch_accepts_base_and_derived(monkeypatch):
+    seen = {}
+    monkeypatch.setattr(main, "compare_companies", lambda companies, concepts, years: seen.update(c=concepts) or {})
+    resp = TestClient(main.app).post("/compare_kpis_batch",
+                                     json={"companies": ["320193"], "concepts": ["Revenues", "NetMargin"]})
+    assert resp.status_code == 200 and seen["c"] == ("Revenues", "NetMargin")
@@ -0,0 +1,95 @@
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+from helper_lib import embed_cache, index_types, retriever
+from helper_lib.embedder import HashingEmbedder, set_embedder
+from helper_lib.index_types import build_index, search_params
+
+FORM = "10-K"
+CIKS = ["0000000101", "0000000202", "0000000303"]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(retriever, "INDEX_DIR", tmp_path)
+    monkeypatch.setattr(retriever, "GLOBAL_INDEX", True)
+    monkeypatch.setattr(embed_cache, "EMBED_CACHE_DIR", tmp_path)
+    set_embedder(HashingEmbedder(512))
+    retriever.invalidate_index_cache()
+    yield tmp_path
+    retriever.invalidate_index_cache()
+
+
+def _chunks(cik: str, n: int, tag: str) -> pd.DataFrame:
+    return pd.DataFrame({
+        "chunk_id": [f"{cik}-{tag}_{i}" for i in range(n)],
+        "cik": cik,
+        "accession": f"{cik}-{tag}",
+        "form": FORM,
+        "filing_date": "2023-02-01",
+        "primary_doc": "d.htm",
+        "section": "Item 7",
+        "text": [f"company {cik} filing {tag} chunk {i} topic {i % 11} word{i}" for i in range(n)],
+    })
+
+
+def _self_lookup(cik: str) -> np.ndarray:
+    """Global id returned for each of `cik`'s own vectors (exact probe)."""
+    index, _ = retriever.load_global_index(FORM)
+    info = retriever._load_info(("info", None, FORM), retriever._info_path("global", FORM))
+    vectors = retriever._index_vectors(retriever.load_faiss_index(cik, FORM))
+    params = search_params(dict(info, nprobe=info.get("nlist", 1)), 1)
+    _, I = index.search(vectors, 1, params=params)
+    return I[:, 0]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat"])
+def test_reingest_keeps_other_companies_ids(store, monkeypatch, index_type):
+    monkeypatch.setattr(index_types, "INDEX_TYPE", index_type)
+    for cik in CIKS:
+        retriever.build_index_for_chunks(_chunks(cik, 400, "A"), cik, FORM)
+    info = retriever._load_info(("info", None, FORM), retriever._info_path("global", FORM))
+    assert info["type"] == index_type
+
+    # Re-ingest the first company with a different number of chunks
+    retriever.build_index_for_chunks(_chunks(CIKS[0], 150, "B"), CIKS[0], FORM)
+
+    for cik in CIKS:
+        expected = retriever._encode_ids(int(cik), len(retriever.load_meta(cik, FORM)))
+        np.testing.assert_array_equal(_self_lookup(cik), expected)
+
+    _, ids_df = retriever.load_global_index(FORM)
+    assert ids_df.groupby("cik").size().to_dict() == {101: 150, 202: 400, 303: 400}
+
+    q = retriever.embed_queries([f"company {CIKS[1]} filing A chunk 7 topic 7"])
+    hits = retriever._multi_vector_search(q, CIKS, FORM, 10)
+    assert not hits["chunk_id"].duplicated().any()
+    assert hits.iloc[0]["chunk_id"] == f"{CIKS[1]}-A_7"
+
+
+def test_id_map_over_ivf_is_rebuilt(store, monkeypatch):
+    monkeypatch.setattr(index_types, "INDEX_TYPE", "ivf_flat")
+    updates = []
+    for cik in CIKS:
+        retriever.build_index_for_chunks(_chunks(cik, 400, "A"), cik, FORM, global_updates=updates)
+
+    # A global index as written before IVF kept its own ids
+    idx_path, _ = retriever._global_paths(FORM)
+    vectors = [retriever._index_vectors(retriever.load_faiss_index(c, FORM)) for c in CIKS]
+    inner, info = build_index(np.vstack(vectors), removable=True)
+    legacy = faiss.IndexIDMap2(inner)
+    legacy.add_with_ids(np.vstack(vectors), np.concatenate([retriever._encode_ids(int(c), 400) for c in CIKS]))
+    retriever.update_global_index_many(updates, FORM)
+    faiss.write_index(legacy, str(idx_path))
+    retriever.invalidate_index_cache()
+
+    # Ignored for search, then replaced on the next update
+    assert retriever.load_global_index(FORM) == (None, None)
+    retriever.build_index_for_chunks(_chunks(CIKS[2], 120, "B"), CIKS[2], FORM)
+    index, _ = retriever.load_global_index(FORM)
+    assert not isinstance(faiss.downcast_index(index), faiss.IndexIDMap)
+    for cik in CIKS:
+        expected = retriever._encode_ids(int(cik), len(retriever.load_meta(cik, FORM)))
+        np.testing.assert_array_equal(_self_lookup(cik), expected)
@@ -0,0 +1,125 @@
+import gzip
+
+import pytest
+
+from helper_lib import html_text
+from helper_lib.html_text import html_file_to_text, html_to_text
+from helper_lib.utils import clean_html_text
+
+pytestmark = pytest.mark.skipif(html_text.etree is None, reason="lxml not installed")
+
+NESTED_TABLES = """
+<html><body>
+<p>Segment results</p>
+<table>
+  <tr><th>Segment</th><th>2023</th><th>2022</th></tr>
+  <tr><td>Americas</td><td>$ 162,560</td><td>169,658</td></tr>
+  <tr><td>Detail</td><td>
+    <table>
+      <tr><td>iPhone</td><td>200,583</td></tr>
+      <tr><td><b>Mac</b> <i>and</i> iPad</td><td>57,694</td></tr>
+    </table>
+  </td><td></td></tr>
+  <tr><td> </td><td></td><td></td></tr>
+</table>
+<p>After the table.</p>
+</body></html>
+"""
+
+INLINE_XBRL = """
+<html xmlns:ix="http://www.xbrl.org/2013/inlineXBRL"><body>
+<div style="display:none"><ix:header><ix:hidden>
+  <ix:nonNumeric name="dei:DocumentType" contextRef="c1">10-K</ix:nonNumeric>
+</ix:hidden></ix:header></div>
+<p>Total net sales were $<ix:nonFraction name="us-gaap:Revenues" contextRef="c1"
+ unitRef="usd" decimals="-6" scale="6">383,285</ix:nonFraction> million.</p>
+<table><tr>
+  <td>Net income</td>
+  <td><ix:nonFraction name="us-gaap:NetIncomeLoss" contextRef="c1" unitRef="usd"
+   decimals="-6" scale="6" sign="-">(1,234)</ix:nonFraction></td>
+</tr></table>
+</body></html>
+"""
+
+SCRIPT_STYLE_HIDDEN = """
+<html><head>
+<title>Annual Report</title>
+<style>p { color: red; } td::after { content: "x"; }</style>
+<script>var x = "<table><tr><td>not a table</td></tr></table>";</script>
+</head><body>
+<!-- a comment that is not text -->
+<div style="display:none">Hidden cover data</div>
+<p>Item 7. Management's Discussion</p>
+<template><p>template text</p></template>
+<script type="text/javascript">document.write("ignored");</script>
+<p>Liquidity remained strong.</p>
+</body></html>
+"""
+
+ENTITIES = """
+<html><body>
+<p>AT&amp;T &mdash; Procter &amp; Gamble&#8217;s &lt;subsidiary&gt;</p>
+<p>Caf&eacute; revenue rose&nbsp;5%&#160;to &euro;1.2&nbsp;billion &#x2014; &copy; 2023</p>
+<table><tr><td>R&amp;D</td><td>&nbsp;</td><td>&#36;&nbsp;29,915</td></tr></table>
+<p>Line one<br>Line two<br/>Line three</p>
+
+
+
+<p>After blank lines.</p>
+</body></html>
+"""
+
+FIXTURES = {
+    "nested_tables": NESTED_TABLES,
+    "inline_xbrl": INLINE_XBRL,
+    "script_style_hidden": SCRIPT_STYLE_HIDDEN,
+    "entities": ENTITIES,
+}
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_html_to_text_matches_clean_html_text(name):
+    html = FIXTURES[name]
+    assert html_to_text(html) == clean_html_text(html)
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_small_read_blocks_match(name, monkeypatch):
+    # Feeding the parser in blocks must not split text nodes or entities
+    monkeypatch.setattr(html_text, "READ_BLOCK_BYTES", 7)
+    html = FIXTURES[name]
+    assert html_to_text(html) == clean_html_text(html)
+
+
+@pytest.mark.parametrize("suffix", [".htm", ".htm.gz"])
+def test_file_extraction_matches(tmp_path, suffix):
+    html = NESTED_TABLES + ENTITIES
+    path = tmp_path / f"doc{suffix}"
+    if suffix.endswith(".gz"):
+        path.write_bytes(gzip.compress(html.encode("utf-8")))
+    else:
+        path.write_text(html, encoding="utf-8")
+    assert html_file_to_text(path) == clean_html_text(html)
+
+
+def test_expected_content():
+    tables = html_to_text(NESTED_TABLES)
+    assert "[TABLE START]\nSegment | 2023 | 2022\nAmericas | $ 162,560 | 169,658" in tables
+    assert "iPhone | 200,583" in tables
+    assert "MacandiPad | 57,694" in tables
+
+    xbrl = html_to_text(INLINE_XBRL)
+    assert "383,285" in xbrl and "Net income | (1,234)" in xbrl
+
+    hidden = html_to_text(SCRIPT_STYLE_HIDDEN)
+    assert "color: red" not in hidden and "document.write" not in hidden
+    assert "not a table" not in hidden and "comment" not in hidden
+    assert "Liquidity remained strong." in hidden
+
+    entities = html_to_text(ENTITIES)
+    assert "AT&T — Procter & Gamble’s <subsidiary>" in entities
+    assert "Café" in entities and "€1.2" in entities and "R&D |  | $\xa029,915" in entities
+
+
+def test_empty_document():
+    assert html_to_text("") == clean_html_text("") == ""
@@ -0,0 +1,141 @@
+from helper_lib.sections import find_headings, split_sections
+
+FILLER = "Revenue grew in every segment during the fiscal year. " * 12
+
+
+def _filing(*blocks) -> str:
+    return "\n".join(blocks) + "\n"
+
+
+TOC = _filing(
+    "ACME CORP",
+    "FORM 10-K",
+    "Table of Contents",
+    "Item 1. Business 3",
+    "Item 1A. Risk Factors 9",
+    "Item 7. Management's Discussion and Analysis 30",
+    "Item 8. Financial Statements and Supplementary Data 45",
+)
+
+
+def _labels(text: str, form: str = "10-K") -> list:
+    return [label for label, _ in split_sections(text, form)]
+
+
+def _section(text: str, label: str) -> str:
+    return dict(split_sections(text))[label]
+
+
+def test_toc_goes_to_cover_and_body_is_split():
+    text = TOC + _filing(
+        "PART I",
+        "Item 1. Business",
+        FILLER,
+        "Item 1A. Risk Factors",
+        FILLER,
+        "ITEM 7 — MANAGEMENT'S DISCUSSION AND ANALYSIS",
+        FILLER,
+        "Item 8.",
+        "Financial Statements and Supplementary Data",
+        FILLER,
+    )
+    assert _labels(text) == ["Cover", "Item 1", "Item 1A", "Item 7", "Item 8"]
+    assert "Table of Contents" in _section(text, "Cover")
+
+
+def test_prose_cross_references_are_not_headings():
+    text = TOC + _filing(
+        "Item 1. Business",
+        FILLER,
+        "Item 1A. Risk Factors",
+        FILLER,
+        "Item 7 of this report discusses how these risks affected our results. " + FILLER[:150],
+        FILLER,
+        "Item 7. Management's Discussion and Analysis",
+        FILLER,
+        "Refer to Part I, Item 1 for a description of our segments.",
+        "Item 1A, above, describes the risks to our liquidity.",
+        FILLER,
+        "Item 8. Financial Statements and Supplementary Data",
+        FILLER,
+    )
+    assert _labels(text) == ["Cover", "Item 1", "Item 1A", "Item 7", "Item 8"]
+    assert "Item 7 of this report" in _section(text, "Item 1A")
+    assert "Refer to Part I, Item 1" in _section(text, "Item 7")
+    assert "Item 1A, above" in _section(text, "Item 7")
+
+
+def test_hyperlinked_cross_reference_on_its_own_line_stays_in_section():
+    # A linked "Item 1A. Risk Factors" in MD&A renders as a heading-like line
+    text = TOC + _filing(
+        "Item 1. Business",
+        FILLER,
+        "Item 1A. Risk Factors",
+        FILLER,
+        "Item 7. Management's Discussion and Analysis",
+        FILLER,
+        "For a discussion of these uncertainties, see",
+        "Item 1A. Risk Factors",
+        "in this report.",
+        FILLER,
+        "Item 1. Business",
+        FILLER,
+        "Item 8. Financial Statements and Supplementary Data",
+        FILLER,
+    )
+    labels = _labels(text)
+    assert labels == ["Cover", "Item 1", "Item 1A", "Item 7", "Item 8"]
+    mdna = _section(text, "Item 7")
+    assert "see\nItem 1A. Risk Factors\nin this report." in mdna
+    # The body starts at the first Item 1, not at the later cross-reference
+    assert FILLER in _section(text, "Item 1")
+    assert _section(text, "Cover") == TOC
+
+
+def test_out_of_order_heading_does_not_swallow_later_items():
+    text = TOC + _filing(
+        "Item 1. Business",
+        FILLER,
+        "Item 7. Management's Discussion and Analysis",
+        FILLER,
+        "Item 9A. Controls and Procedures",
+        FILLER,
+        "Item 7A. Quantitative and Qualitative Disclosures About Market Risk",
+        FILLER,
+        "Item 8. Financial Statements and Supplementary Data",
+        FILLER,
+        "Item 9A. Controls and Procedures",
+        FILLER,
+    )
+    assert _labels(text) == ["Cover", "Item 1", "Item 7", "Item 7A", "Item 8", "Item 9A"]
+
+
+def test_headings_inside_tables_and_long_lines_are_ignored():
+    text = _filing(
+        "Item 1. Business",
+        FILLER,
+        "[TABLE START]",
+        "Item 7 | Management's Discussion | 30",
+        "[TABLE END]",
+        "Item 7A. " + "Quantitative disclosures " * 12,
+        FILLER,
+    )
+    assert [label for _, label in find_headings(text)] == ["Item 1"]
+
+
+def test_quarterly_items_restart_per_part():
+    text = _filing(
+        "PART I",
+        "Item 1. Financial Statements",
+        FILLER,
+        "Item 2. Management's Discussion and Analysis",
+        FILLER,
+        "PART II",
+        "Item 1. Legal Proceedings",
+        FILLER,
+        "Item 1A. Risk Factors",
+        FILLER,
+    )
+    assert _labels(text, "10-Q") == [
+        "Cover", "Part I Item 1", "Part I Item 2", "Part II Item 1", "Part II Item 1A",
+    ]
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from helper_lib import xbrl
+from helper_lib.xbrl import _extract_metrics, _select_concepts, parse_companyfacts
+
+
+class _NoDecode(bytes):
+    """A body whose full decode fails the test; slices are plain bytes."""
+
+    def decode(self, *args, **kwargs):
+        raise AssertionError("the whole companyfacts body was decoded")
+
+
+def _concept(label, rows, unit="USD", description=None):
+    return {
+        "label": label,
+        "description": description or f"Amount of {label.lower()}.",
+        "units": {unit: rows},
+    }
+
+
+def _rows(base, years=range(2018, 2024)):
+    out = []
+    for fy in years:
+        out.append({"end": f"{fy}-12-31", "val": base * (fy - 2000), "accn": f"0001-{fy}", "fy": fy,
+                    "fp": "FY", "form": "10-K", "filed": f"{fy + 1}-02-01"})
+        # Quarterly and amended rows that the extractor must drop / dedupe
+        out.append({"end": f"{fy}-06-30", "val": base, "accn": f"0002-{fy}", "fy": fy,
+                    "fp": "Q2", "form": "10-Q", "filed": f"{fy}-08-01"})
+        out.append({"end": f"{fy - 1}-12-31", "val": base * 2, "accn": f"0003-{fy}", "fy": fy,
+                    "fp": "FY", "form": "10-K", "frame": f"CY{fy - 1}"})
+    return out
+
+
+def _companyfacts(us_gaap: dict, others_first=True, others_last=True) -> dict:
+    facts = {}
+    if others_first:
+        facts["dei"] = {
+            "EntityCommonStockSharesOutstanding": _concept("Shares", _rows(7), unit="shares"),
+            # Same tag name outside us-gaap must not be picked up
+            "Revenues": _concept("Not us-gaap revenues", _rows(-1)),
+        }
+    facts["us-gaap"] = us_gaap
+    if others_last:
+        facts["srt"] = {"Assets": _concept("Not us-gaap assets", _rows(-3))}
+    return {"cik": 320193, "entityName": "Example Inc.", "facts": facts}
+
+
+US_GAAP = {
+    "AccountsPayableCurrent": _concept(
+        "Accounts Payable", _rows(11),
+        description='Mentions "Revenues": {"label": "x"} and \\u00e9 inside a string.',
+    ),
+    "RevenueFromContractWithCustomerExcludingAssessedTax": _concept("Revenue from contracts", _rows(100)),
+    "NetIncomeLoss": _concept("Net Income (Loss)", _rows(25)),
+    "Assets": _concept("Assets — total", _rows(300)),
+    "Liabilities": _concept("Liabilities", _rows(200), unit="USD"),
+    "OperatingIncomeLoss": _concept("Operating Income", _rows(30)),
+    "EarningsPerShareBasic": _concept("EPS", _rows(2), unit="USD/shares"),
+}
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("others_first,others_last", [(True, True), (False, True), (True, False), (False, False)])
+def test_selective_decode_matches_full_parse(indent, others_first, others_last):
+    data = _companyfacts(US_GAAP, others_first, others_last)
+    body = json.dumps(data, indent=indent, ensure_ascii=False).encode("utf-8")
+    assert parse_companyfacts(_NoDecode(body)) == _extract_metrics(json.loads(body))
+
+
+def test_preferred_tag_wins_when_both_present():
+    us_gaap = dict(US_GAAP, Revenues=_concept("Revenues", _rows(90)))
+    body = json.dumps(_companyfacts(us_gaap)).encode()
+    out = parse_companyfacts(_NoDecode(body))
+    assert out == _extract_metrics(json.loads(body))
+    assert {r["tag"] for r in out["Revenues"]} == {"Revenues"}
+
+
+def test_missing_concepts_are_empty():
+    us_gaap = {k: v for k, v in US_GAAP.items() if k not in ("Liabilities", "OperatingIncomeLoss")}
+    body = json.dumps(_companyfacts(us_gaap)).encode()
+    out = parse_companyfacts(_NoDecode(body))
+    assert out == _extract_metrics(json.loads(body))
+    assert out["Liabilities"] == [] and out["OperatingIncome"] == []
+
+
+def test_only_requested_tags_are_decoded():
+    body = json.dumps(_companyfacts(US_GAAP)).encode()
+    found = _select_concepts(_NoDecode(body), ["Assets", "NetIncomeLoss", "NoSuchTag"])
+    assert set(found) == {"Assets", "NetIncomeLoss"}
+    assert found["Assets"] == US_GAAP["Assets"]
+
+
+def test_unrecognised_layout_falls_back_to_full_parse():
+    data = {"facts": {"us-gaap": {"Assets": {"units": {"USD": _rows(300)}}}}}
+    body = json.dumps(data).encode()
+    assert _select_concepts(body, ["Assets"]) is None
+    assert parse_companyfacts(body) == _extract_metrics(data)
+
+
+def test_decodes_only_the_selected_slices(monkeypatch):
+    body = json.dumps(_companyfacts(US_GAAP)).encode()
+    decoded = []
+    real = xbrl._decoder.raw_decode
+    monkeypatch.setattr(xbrl._decoder, "raw_decode", lambda s, idx=0: decoded.append(len(s)) or real(s, idx))
+    parse_companyfacts(_NoDecode(body))
+    # One slice per found tag, together a fraction of the body
+    assert len(decoded) == 5
+    assert sum(decoded) < len(body) / 2